@@ -0,0 +1,329 @@
+"""
+Replay webhook events against local stand-ins for GitHub and Redmine and report how fast they
+were processed and how many requests they caused.
+
+    python -m benchmarks [--scenario NAME] [--scale FACTOR] [--json]
+
+The payloads in benchmarks/fixtures are real webhook payloads, trimmed to what the processor
+uses. Each scenario derives its events from them.
+"""
+# pylint: disable=wrong-import-position
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable
+
+# The stand-ins don't limit anything and nothing should be persisted. These must be set before
+# the processor is imported.
+for name, value in (('GITHUB_RATE', '100000'), ('GITHUB_BURST', '100000'),
+                    ('REDMINE_RATE', '100000'), ('REDMINE_BURST', '100000'),
+                    ('REDMINE_JOURNAL', ''), ('CHECK_DEBOUNCE_DELAY', '0.05'),
+                    ('REDMINE_WRITE_DELAY', '0.05'), ('CONFIG_RELOAD_INTERVAL', '0')):
+    os.environ.setdefault(name, value)
+
+from aiohttp import ClientSession
+from octomachinery.github.api.raw_client import RawGitHubAPI
+from octomachinery.github.api.tokens import GitHubOAuthToken
+
+from benchmarks.stubs import GitHubStub, RedmineStub
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+FIXTURE_API_URL = 'https://api.github.com'
+FIXTURE_NUMBER = 10000
+FIXTURE_SHA = '0000000000000000000000000000000000000001'
+FIXTURE_CHECK_SUITE = 20000000000
+
+logger = logging.getLogger('benchmarks')  # pylint: disable=invalid-name
+
+
+def load_fixture(name: str) -> dict:
+    with open(FIXTURES / f'{name}.json') as fixture_fp:
+        return json.load(fixture_fp)
+
+
+def rewrite(value: Any, replacements: dict[str, str]) -> Any:
+    if isinstance(value, dict):
+        return {key: rewrite(item, replacements) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rewrite(item, replacements) for item in value]
+    if isinstance(value, str):
+        for old, new in replacements.items():
+            value = value.replace(old, new)
+    return value
+
+
+def make_commits(count: int, issue_ids: list[int], action: str = 'Fixes') -> list[dict]:
+    """
+    Each commit references the next issue, wrapping around when there are more commits
+    """
+    return [{
+        'sha': f'{random.getrandbits(160):040x}',
+        'commit': {
+            'message': f'{action} #{issue_ids[i % len(issue_ids)]} - Change {i}\n\nSome details',
+        },
+    } for i in range(count)]
+
+
+@dataclass
+class Scenario:
+    name: str
+    description: str
+    api_url: str
+    events: list[tuple[str, dict]] = field(default_factory=list)
+    pull_requests: list[tuple[dict, list[dict]]] = field(default_factory=list)
+    # Whether all events arrive at once instead of at the configured concurrency
+    burst: bool = False
+
+    def _replacements(self, number: int, sha: str) -> dict[str, str]:
+        # The stand-in uses the PR number as the check suite ID
+        return {FIXTURE_API_URL: self.api_url, f'/{FIXTURE_NUMBER}': f'/{number}',
+                f'/{FIXTURE_CHECK_SUITE}/': f'/{number}/', FIXTURE_SHA: sha}
+
+    def add_pull_request(self, number: int, commits: list[dict]) -> dict:
+        replacements = self._replacements(number, f'{random.getrandbits(160):040x}')
+        pull_request = rewrite(load_fixture('pull_request.opened')['pull_request'], replacements)
+        pull_request.update(number=number, commits=len(commits))
+        self.pull_requests.append((pull_request, commits))
+        return pull_request
+
+    def add_event(self, handler: str, fixture: str, pull_request: dict) -> None:
+        payload = rewrite(load_fixture(fixture),
+                          self._replacements(pull_request['number'], pull_request['head']['sha']))
+        if 'pull_request' in payload:
+            merged = payload['pull_request'].get('merged', False)
+            payload['pull_request'] = dict(copy.deepcopy(pull_request), merged=merged)
+            payload['number'] = pull_request['number']
+        else:
+            payload['check_suite']['pull_requests'][0]['number'] = pull_request['number']
+        self.events.append((handler, payload))
+
+
+def build_scenarios(github: GitHubStub, scale: float) -> list[Scenario]:
+    def scaled(value: int) -> int:
+        return max(1, int(value * scale))
+
+    numbers = iter(range(1, 1000000))
+    issues = iter(range(30000, 1000000))
+    api_url = github.url or ''
+
+    small = Scenario('small-prs', 'PRs with a few commits being opened', api_url)
+    for _ in range(scaled(40)):
+        pull_request = small.add_pull_request(next(numbers), make_commits(3, [next(issues)]))
+        small.add_event('on_pr_modified', 'pull_request.opened', pull_request)
+
+    many_commits = Scenario('many-commits', 'PRs with more commits than a single listing holds',
+                            api_url)
+    for _ in range(scaled(4)):
+        commits = make_commits(scaled(600), [next(issues) for _ in range(10)], action='Refs')
+        pull_request = many_commits.add_pull_request(next(numbers), commits)
+        many_commits.add_event('on_pr_modified', 'pull_request.opened', pull_request)
+
+    many_issues = Scenario('many-issues', 'PRs referencing a different issue in every commit',
+                           api_url)
+    for _ in range(scaled(4)):
+        count = scaled(250)
+        pull_request = many_issues.add_pull_request(
+            next(numbers), make_commits(count, [next(issues) for _ in range(count)]))
+        many_issues.add_event('on_suite_run', 'check_suite.requested', pull_request)
+
+    burst = Scenario('burst', 'Bursts of pushes and check suites for the same PRs', api_url,
+                     burst=True)
+    for _ in range(scaled(10)):
+        pull_request = burst.add_pull_request(next(numbers), make_commits(5, [next(issues)]))
+        burst.add_event('on_pr_modified', 'pull_request.opened', pull_request)
+        for _ in range(4):
+            burst.add_event('on_pr_modified', 'pull_request.synchronize', pull_request)
+        for _ in range(2):
+            burst.add_event('on_suite_run', 'check_suite.requested', pull_request)
+    random.shuffle(burst.events)
+
+    rerequested = Scenario('rerequested', 'Checks that are requested again for unchanged PRs',
+                           api_url)
+    for _ in range(scaled(20)):
+        pull_request = rerequested.add_pull_request(
+            next(numbers), make_commits(20, [next(issues) for _ in range(2)]))
+        rerequested.add_event('on_pr_modified', 'pull_request.opened', pull_request)
+    for _ in range(2):
+        for pull_request, _commits in rerequested.pull_requests:
+            rerequested.add_event('on_suite_run', 'check_suite.requested', pull_request)
+            rerequested.events[-1][1]['action'] = 'rerequested'
+
+    merge = Scenario('merge', 'Merged PRs that set the fixed in version', api_url)
+    for _ in range(scaled(20)):
+        pull_request = merge.add_pull_request(
+            next(numbers), make_commits(3, [next(issues) for _ in range(3)]))
+        merge.add_event('on_pr_merge', 'pull_request.closed', pull_request)
+
+    return [small, many_commits, many_issues, burst, rerequested, merge]
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+@dataclass
+class Result:
+    scenario: str
+    events: int
+    duration: float
+    p50: float
+    p99: float
+    github_calls: int
+    # GitHub requests that were answered with 304 Not Modified
+    github_not_modified: int
+    redmine_calls: int
+    calls: dict[str, int]
+
+    @property
+    def throughput(self) -> float:
+        return self.events / self.duration if self.duration else 0
+
+
+async def run_scenario(scenario: Scenario, handlers: dict[str, Callable], concurrency: int,
+                       github: GitHubStub, redmine: RedmineStub) -> Result:
+    # pylint: disable=import-outside-toplevel
+    from prprocessor.redmine import flush_updates
+
+    for pull_request, commits in scenario.pull_requests:
+        github.add_pull_request(pull_request, commits)
+    github.calls.clear()
+    github.not_modified.clear()
+    redmine.calls.clear()
+
+    semaphore = asyncio.Semaphore(len(scenario.events) if scenario.burst else concurrency)
+    latencies: list[float] = []
+
+    async def process(handler: str, payload: dict) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await handlers[handler](SimpleNamespace(payload=payload))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(process(handler, payload) for handler, payload in scenario.events))
+    await flush_updates()
+    duration = time.perf_counter() - start
+
+    return Result(scenario=scenario.name, events=len(scenario.events), duration=duration,
+                  p50=percentile(latencies, 50), p99=percentile(latencies, 99),
+                  github_calls=github.total_calls,
+                  github_not_modified=sum(github.not_modified.values()),
+                  redmine_calls=redmine.total_calls,
+                  calls={f'GitHub {call}': count for call, count in github.calls.items()} |
+                  {f'GitHub 304 {call}': count for call, count in github.not_modified.items()} |
+                  {f'Redmine {call}': count for call, count in redmine.calls.items()})
+
+
+def reset_caches() -> None:
+    # pylint: disable=import-outside-toplevel
+    from prprocessor import __main__ as app, commits, redmine
+
+    for cache in (app.CHECK_CACHE, app.GITHUB_CACHE, commits.COMMIT_CACHE, redmine.ISSUE_CACHE,
+                  redmine.PROJECT_CACHE, redmine.VERSION_CACHE):
+        cache.clear()
+
+
+async def main(args: argparse.Namespace) -> list[Result]:
+    github = GitHubStub(latency=args.github_latency)
+    redmine = RedmineStub(latency=args.redmine_latency, projects=['foreman'])
+    await github.start()
+    await redmine.start()
+    os.environ['REDMINE_URL'] = redmine.url or ''
+
+    # pylint: disable=import-outside-toplevel
+    from octomachinery.app.runtime.context import RUNTIME_CONTEXT
+    from prprocessor import __main__ as app
+
+    handlers = {name: getattr(app, name) for name in ('on_pr_modified', 'on_suite_run',
+                                                        'on_pr_merge')}
+    results = []
+    try:
+        async with ClientSession() as session:
+            # The same client octomachinery uses for app installations
+            RUNTIME_CONTEXT.app_installation_client = RawGitHubAPI(
+                GitHubOAuthToken('benchmark'), session=session,
+                user_agent='prprocessor-benchmark', base_url=github.url)
+
+            for scenario in build_scenarios(github, args.scale):
+                if args.scenario and scenario.name not in args.scenario:
+                    continue
+                reset_caches()
+                logger.info('Running %s: %s', scenario.name, scenario.description)
+                results.append(await run_scenario(scenario, handlers, args.concurrency, github,
+                                                  redmine))
+    finally:
+        await github.stop()
+        await redmine.stop()
+
+    return results
+
+
+def print_results(results: list[Result], verbose: bool) -> None:
+    header = (f'{"scenario":<14} {"events":>6} {"time (s)":>8} {"events/s":>9} '
+              f'{"p50 (ms)":>9} {"p99 (ms)":>9} {"GitHub":>7} {"304s":>5} {"Redmine":>8}')
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f'{result.scenario:<14} {result.events:>6} {result.duration:>8.2f} '
+              f'{result.throughput:>9.1f} {result.p50 * 1000:>9.1f} {result.p99 * 1000:>9.1f} '
+              f'{result.github_calls:>7} {result.github_not_modified:>5} '
+              f'{result.redmine_calls:>8}')
+        if verbose:
+            for call, count in sorted(result.calls.items()):
+                print(f'    {count:>6}  {call}')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append',
+                        help='Only run this scenario, can be given multiple times')
+    parser.add_argument('--scale', type=float, default=1,
+                        help='Multiply the number of PRs, commits and issues (default: 1)')
+    parser.add_argument('--concurrency', type=int,
+                        default=int(os.environ.get('JOB_CONCURRENCY', '8')),
+                        help='Number of events processed at the same time (default: 8)')
+    parser.add_argument('--github-latency', type=float, default=0.05,
+                        help='Seconds before GitHub responds (default: 0.05)')
+    parser.add_argument('--redmine-latency', type=float, default=0.02,
+                        help='Seconds before Redmine responds (default: 0.02)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the generated commits and SHAs, so runs can be compared '
+                             '(default: 0)')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Show the number of requests per endpoint')
+    return parser.parse_args()
+
+
+def run_benchmarks() -> None:
+    args = parse_args()
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    results = asyncio.run(main(args))
+    if args.json:
+        print(json.dumps([dict(vars(result), throughput=result.throughput)
+                          for result in results], indent=2))
+    else:
+        print_results(results, args.verbose)
+
+
+if __name__ == '__main__':
+    run_benchmarks()
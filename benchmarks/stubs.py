@@ -0,0 +1,264 @@
+"""
+Local stand-ins for the GitHub and Redmine APIs. They only implement what the PR processor uses,
+answer after a configurable latency and count every request they receive.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import Counter
+from typing import Any, Optional
+
+from aiohttp import web
+
+
+class Stub:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.app = web.Application(middlewares=[self.middleware])
+        self.url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        route = request.match_info.route.resource
+        name = route.canonical if route is not None else request.path
+        self.calls[f'{request.method} {name}'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f'http://127.0.0.1:{port}'
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class GitHubStub(Stub):
+    """
+    Serves pull requests, their commits, check runs and labels. Like GitHub it answers
+    conditional requests for unchanged responses with 304 Not Modified.
+    """
+
+    def __init__(self, latency: float):
+        super().__init__(latency)
+        self.not_modified: Counter[str] = Counter()
+        self.pull_requests: dict[tuple[str, int], dict] = {}
+        self.commits: dict[str, list[dict]] = {}
+        self.check_runs: dict[int, dict] = {}
+        self.app.add_routes([
+            web.get('/repos/{owner}/{repo}/pulls', self.list_pull_requests),
+            web.get('/repos/{owner}/{repo}/pulls/{number}', self.get_pull_request),
+            web.get('/repos/{owner}/{repo}/pulls/{number}/commits', self.get_commits),
+            web.get('/repos/{owner}/{repo}/compare/{base}...{head}', self.compare),
+            web.get('/repos/{owner}/{repo}/check-suites/{id}/check-runs', self.get_check_runs),
+            web.get('/repos/{owner}/{repo}/commits/{sha}/check-runs', self.get_commit_check_runs),
+            web.post('/repos/{owner}/{repo}/check-runs', self.create_check_run),
+            web.patch('/repos/{owner}/{repo}/check-runs/{id}', self.update_check_run),
+            web.post('/repos/{owner}/{repo}/issues/{number}/labels', self.add_labels),
+            web.delete('/repos/{owner}/{repo}/issues/{number}/labels/{name}', self.remove_label),
+        ])
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        response = await super().middleware(request, handler)
+        if request.method != 'GET' or response.status != 200 or \
+                not isinstance(response, web.Response) or response.body is None:
+            return response
+
+        etag = f'"{hashlib.sha1(response.body).hexdigest()}"'
+        if request.headers.get('If-None-Match') == etag:
+            route = request.match_info.route.resource
+            self.not_modified[f'GET {route.canonical if route else request.path}'] += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        response.headers['ETag'] = etag
+        return response
+
+    def add_pull_request(self, pull_request: dict, commits: list[dict]) -> None:
+        repository = pull_request['base']['repo']['full_name']
+        self.pull_requests[(repository, pull_request['number'])] = pull_request
+        self.commits[pull_request['head']['sha']] = commits
+
+    @staticmethod
+    def _respond(data: Any, status: int = 200, headers: Optional[dict] = None) -> web.Response:
+        headers = dict(headers or {})
+        headers.update({
+            'X-RateLimit-Limit': '5000',
+            'X-RateLimit-Remaining': '4999',
+            'X-RateLimit-Reset': str(int(time.time()) + 3600),
+        })
+        return web.json_response(data, status=status, headers=headers)
+
+    def _paginate(self, request: web.Request, items: list) -> tuple[list, dict]:
+        per_page = int(request.query.get('per_page', '30'))
+        page = int(request.query.get('page', '1'))
+        start = (page - 1) * per_page
+        headers = {}
+        if start + per_page < len(items):
+            next_url = request.url.update_query(page=page + 1)
+            headers['Link'] = f'<{next_url}>; rel="next"'
+        return items[start:start + per_page], headers
+
+    async def list_pull_requests(self, request: web.Request) -> web.Response:
+        repository = f'{request.match_info["owner"]}/{request.match_info["repo"]}'
+        state = request.query.get('state', 'open')
+        pull_requests = [pull_request for (name, _), pull_request
+                         in sorted(self.pull_requests.items())
+                         if name == repository and state in ('all', pull_request['state'])]
+        page, headers = self._paginate(request, pull_requests)
+        return self._respond(page, headers=headers)
+
+    async def get_pull_request(self, request: web.Request) -> web.Response:
+        key = (f'{request.match_info["owner"]}/{request.match_info["repo"]}',
+               int(request.match_info['number']))
+        return self._respond(self.pull_requests[key])
+
+    async def get_commits(self, request: web.Request) -> web.Response:
+        key = (f'{request.match_info["owner"]}/{request.match_info["repo"]}',
+               int(request.match_info['number']))
+        pull_request = self.pull_requests[key]
+        # Like GitHub this endpoint never returns more than 250 commits
+        commits = self.commits[pull_request['head']['sha']][:250]
+        page, headers = self._paginate(request, commits)
+        return self._respond(page, headers=headers)
+
+    async def compare(self, request: web.Request) -> web.Response:
+        page, headers = self._paginate(request, self.commits[request.match_info['head']])
+        return self._respond({'status': 'ahead', 'commits': page}, headers=headers)
+
+    async def get_check_runs(self, request: web.Request) -> web.Response:
+        # Check suites are identified by the number of their PR
+        key = (f'{request.match_info["owner"]}/{request.match_info["repo"]}',
+               int(request.match_info['id']))
+        head_sha = self.pull_requests[key]['head']['sha']
+        check_runs = [check_run for check_run in self.check_runs.values()
+                      if check_run['head_sha'] == head_sha]
+        return self._respond({'total_count': len(check_runs), 'check_runs': check_runs})
+
+    async def get_commit_check_runs(self, request: web.Request) -> web.Response:
+        name = request.query.get('check_name')
+        check_runs = [check_run for check_run in self.check_runs.values()
+                      if check_run['head_sha'] == request.match_info['sha'] and
+                      name in (None, check_run['name'])]
+        return self._respond({'total_count': len(check_runs), 'check_runs': check_runs})
+
+    async def create_check_run(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        check_run_id = len(self.check_runs) + 1
+        check_run = dict(data, id=check_run_id, output=data.get('output', {}),
+                         conclusion=data.get('conclusion'),
+                         url=f'{self.url}{request.path}/{check_run_id}')
+        self.check_runs[check_run_id] = check_run
+        return self._respond(check_run, status=201)
+
+    async def update_check_run(self, request: web.Request) -> web.Response:
+        check_run = self.check_runs[int(request.match_info['id'])]
+        check_run.update(await request.json())
+        return self._respond(check_run)
+
+    async def add_labels(self, request: web.Request) -> web.Response:
+        labels = await request.json()
+        return self._respond([{'name': label} for label in labels])
+
+    async def remove_label(self, request: web.Request) -> web.Response:
+        return self._respond([])
+
+
+class RedmineStub(Stub):
+    """
+    Serves issues, projects and versions. Every issue exists and belongs to the first project.
+    """
+
+    def __init__(self, latency: float, projects: list[str]):
+        super().__init__(latency)
+        self.projects = {identifier: {'id': project_id, 'identifier': identifier,
+                                      'name': identifier.title()}
+                         for project_id, identifier in enumerate(projects, start=1)}
+        self.issues: dict[int, dict] = {}
+        self.app.add_routes([
+            web.get('/issues.json', self.filter_issues),
+            web.get('/issues/{id}.json', self.get_issue),
+            web.put('/issues/{id}.json', self.update_issue),
+            web.get('/projects/{id}/versions.json', self.get_versions),
+            web.get('/projects/{id}.json', self.get_project),
+            web.get('/issue_statuses.json', self.get_statuses),
+        ])
+
+    def get_or_create_issue(self, issue_id: int) -> dict:
+        if issue_id not in self.issues:
+            project = next(iter(self.projects.values()))
+            self.issues[issue_id] = {
+                'id': issue_id,
+                'subject': f'Issue {issue_id}',
+                'project': {'id': project['id'], 'name': project['name']},
+                'status': {'id': 1, 'name': 'New'},
+                'updated_on': '2024-01-01T00:00:00Z',
+                'custom_fields': [
+                    {'id': 7, 'name': 'Pull request', 'multiple': True, 'value': []},
+                    {'id': 12, 'name': 'Fixed in Releases', 'multiple': True, 'value': []},
+                ],
+            }
+        return self.issues[issue_id]
+
+    async def filter_issues(self, request: web.Request) -> web.Response:
+        if 'issue_id' in request.query:
+            issue_ids = [int(issue_id) for issue_id in request.query['issue_id'].split(',')
+                         if issue_id]
+            issues = [self.get_or_create_issue(issue_id) for issue_id in issue_ids]
+        elif request.query.get('cf_7') == '*':
+            # Issues linked to a PR
+            issues = [issue for _, issue in sorted(self.issues.items())
+                      if issue['custom_fields'][0]['value']]
+        else:
+            issues = [issue for _, issue in sorted(self.issues.items())]
+        limit = int(request.query.get('limit', '25'))
+        offset = int(request.query.get('offset', '0'))
+        return web.json_response({'issues': issues[offset:offset + limit],
+                                  'total_count': len(issues), 'limit': limit, 'offset': offset})
+
+    async def get_issue(self, request: web.Request) -> web.Response:
+        issue = self.get_or_create_issue(int(request.match_info['id']))
+        return web.json_response({'issue': issue})
+
+    async def update_issue(self, request: web.Request) -> web.Response:
+        issue = self.get_or_create_issue(int(request.match_info['id']))
+        updates = (await request.json())['issue']
+        for custom_field in updates.get('custom_fields', []):
+            for existing in issue['custom_fields']:
+                if existing['id'] == custom_field['id']:
+                    existing['value'] = custom_field['value']
+        if 'status_id' in updates:
+            issue['status'] = {'id': updates['status_id'], 'name': str(updates['status_id'])}
+        return web.Response(status=204)
+
+    def _find_project(self, project_id: str) -> dict:
+        for identifier, project in self.projects.items():
+            if project_id in (identifier, str(project['id'])):
+                return project
+        raise web.HTTPNotFound()
+
+    async def get_project(self, request: web.Request) -> web.Response:
+        return web.json_response({'project': self._find_project(request.match_info['id'])})
+
+    async def get_versions(self, request: web.Request) -> web.Response:
+        project = self._find_project(request.match_info['id'])
+        versions = [{'id': project['id'] * 100 + minor, 'name': f'3.{minor}.0', 'status': 'open',
+                     'updated_on': '2024-01-01T00:00:00Z',
+                     'project': {'id': project['id'], 'name': project['name']}}
+                    for minor in range(8, 13)]
+        return web.json_response({'versions': versions, 'total_count': len(versions)})
+
+    async def get_statuses(self, request: web.Request) -> web.Response:
+        return web.json_response({'issue_statuses': [{'id': 1, 'name': 'New'}]})
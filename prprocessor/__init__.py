@@ -2,6 +2,8 @@ import re
 from typing import Optional
 
 PACKAGING_STABLE_BRANCH_REGEX = re.compile(r'(?:rpm|deb)/(?P<version>\d+\.\d+)')
+PULL_REQUEST_URL_REGEX = re.compile(
+    r'\Ahttps://github\.com/(?P<repository>[\w.-]+/[\w.-]+)/pull/(?P<number>\d+)/?\Z')
 
 def get_version_prefix_from_branch(target_branch: str) -> Optional[str]:
     """
@@ -57,3 +59,18 @@ def is_stable_branch(branch_name: str) -> bool:
     """
     version_prefix = get_version_prefix_from_branch(branch_name)
     return version_prefix is not None and version_prefix != ''
+
+
+def parse_pull_request_url(url: str) -> Optional[tuple[str, int]]:
+    """
+    Get the repository and number from the URL of a PR, as it's linked in Redmine
+
+    >>> parse_pull_request_url('https://github.com/theforeman/foreman/pull/10000')
+    ('theforeman/foreman', 10000)
+    >>> parse_pull_request_url('https://github.com/theforeman/foreman/issues/10000') is None
+    True
+    """
+    match = PULL_REQUEST_URL_REGEX.match(url)
+    if match is None:
+        return None
+    return match.group('repository'), int(match.group('number'))
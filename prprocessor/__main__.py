@@ -1,33 +1,105 @@
 # pylint: disable=missing-module-docstring,missing-class-docstring,missing-function-docstring
 
+import argparse
 import asyncio
+import contextvars
+import json
 import logging
-import re
-from dataclasses import dataclass, field
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from enum import Enum
-from typing import AsyncGenerator, Collection, Generator, Iterable, Mapping, Optional
+from functools import partial, wraps
+from typing import (Any, AsyncGenerator, Awaitable, Callable, Collection, Generator, Iterable,
+                    Mapping, Optional)
 
-import yaml
+from aiohttp import ClientConnectionError, ClientPayloadError, ClientSession, web
+from gidgethub import BadRequest, GitHubBroken, RateLimitExceeded
+from octomachinery.app.config import BotAppConfig
 from octomachinery.app.routing import process_event_actions
 from octomachinery.app.routing.decorators import process_webhook_payload
 from octomachinery.app.runtime.context import RUNTIME_CONTEXT
-from octomachinery.app.server.runner import run as run_app
-from pkg_resources import resource_filename
+from octomachinery.app.routing.webhooks_dispatcher import route_github_webhook_event
+from octomachinery.app.server.machinery import (get_server_runner, log_webhook_secret_status,
+                                                start_tcp_site)
+from octomachinery.github.api.app_client import GitHubApp
 from redminelib.resources import Issue, Project
 
-from prprocessor import get_version_prefix_from_branch, is_stable_branch
-from prprocessor.redmine import (Field, Status, get_issues, get_latest_open_version, get_redmine,
-                                 set_fixed_in_version, verify_issues, IssueValidation)
+from prprocessor import get_version_prefix_from_branch, is_stable_branch, parse_pull_request_url
+from prprocessor.cache import TTLCache
+from prprocessor.commits import COMMIT_CACHE, Commit, parse_commit
+from prprocessor.configuration import CONFIG_STORE, UnconfiguredRepository, get_config
+from prprocessor.httpcache import DiskStore, ResponseCache
+from prprocessor.metrics import (METRICS_PORT, REGISTRY, STAGE_DURATION, record_event,
+                                 record_request, start_metrics_server)
+from prprocessor.ratelimit import Priority, RateLimiter
+from prprocessor.retry import NO_RETRY, RetryBudget, RetryPolicy, call_with_retry
+from prprocessor.scheduler import Debouncer, JobScheduler
+from prprocessor.tracing import close_exporters, set_attributes, span, start_trace
+from prprocessor.redmine import (Action, Field, Mutation, get_issues, get_latest_open_version,
+                                 get_linked_issues, get_project, get_redmine, flush_updates,
+                                 invalidate_caches, is_unavailable, replay_journal, update_issues,
+                                 verify_issues, wait_until_available, IssueValidation, ISSUE_CACHE,
+                                 PROJECT_CACHE, REDMINE_BREAKER, REDMINE_LIMITER,
+                                 REDMINE_RETRY_BUDGET, VERSION_CACHE, WRITE_BUFFER,
+                                 get_redmine_stats)
 
 
-COMMIT_VALID_SUMMARY_REGEX = re.compile(
-    r'\A(?P<action>fixes|refs) (?P<issues>#(\d+)(, ?#(\d+))*)(:| -) .*\Z',
-    re.IGNORECASE,
-)
-COMMIT_ISSUES_REGEX = re.compile(r'#(\d+)')
 CHECK_NAME = 'Redmine issues'
-WHITELISTED_ORGANIZATIONS = ('theforeman', 'Katello')
+# GitHub allows at most 100 items per page
+GITHUB_PAGE_SIZE = int(os.environ.get('GITHUB_PAGE_SIZE', '100'))
+# The pull request commits endpoint never returns more than this
+PR_COMMITS_LIMIT = 250
+# Number of PRs from a single check run or suite that are checked at the same time
+PR_CONCURRENCY = int(os.environ.get('PR_CONCURRENCY', '4'))
+# How long to wait for queued events on shutdown
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', '60'))
+# How often to check the configuration files for changes, 0 disables it
+CONFIG_RELOAD_INTERVAL = float(os.environ.get('CONFIG_RELOAD_INTERVAL', '10'))
+# How often PR links in Redmine are compared with GitHub, 0 disables it
+RECONCILE_INTERVAL = float(os.environ.get('RECONCILE_INTERVAL', '600'))
+# Number of linked issues compared each time, which bounds the requests it makes
+RECONCILE_BATCH_SIZE = int(os.environ.get('RECONCILE_BATCH_SIZE', '100'))
+
+
+def github_retry_after(exc: Exception) -> Optional[float]:
+    if isinstance(exc, RateLimitExceeded):
+        return exc.rate_limit.reset_datetime.timestamp() - time.time()
+    if isinstance(exc, BadRequest) and exc.status_code in (403, 429):
+        headers = getattr(exc, 'headers', None) or {}
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+        # Secondary rate limits don't always say how long to wait
+        if 'rate limit' in str(exc).lower():
+            return 60
+    return None
+
+
+GITHUB_LIMITER = RateLimiter('GitHub', rate=float(os.environ.get('GITHUB_RATE', '10')),
+                             burst=int(os.environ.get('GITHUB_BURST', '20')),
+                             retry_after=github_retry_after)
+GITHUB_RETRY = RetryPolicy(
+    retry_on=(ClientConnectionError, ClientPayloadError, asyncio.TimeoutError, GitHubBroken),
+    attempts=int(os.environ.get('GITHUB_RETRIES', '3')),
+    deadline=float(os.environ.get('GITHUB_RETRY_DEADLINE', '60')),
+)
+GITHUB_RETRY_BUDGET = RetryBudget('GitHub')
+# A POST that failed may still have been processed, so retrying it could create a duplicate
+GITHUB_IDEMPOTENT_METHODS = frozenset({'getitem', 'getiter', 'patch', 'put', 'delete'})
+# GitHub responses with their ETag, so repeated requests can be conditional. Responses that don't
+# fit in memory are also kept in a file if GITHUB_DISK_CACHE is set.
+GITHUB_DISK_CACHE = os.environ.get('GITHUB_DISK_CACHE')
+GITHUB_CACHE = ResponseCache(
+    maxsize=int(os.environ.get('GITHUB_CACHE_SIZE', '1024')),
+    disk=DiskStore(GITHUB_DISK_CACHE, maxsize=int(os.environ.get('GITHUB_DISK_CACHE_SIZE',
+                                                                 '16384')))
+    if GITHUB_DISK_CACHE else None,
+)
 
 
 class Label(Enum):
@@ -53,57 +125,214 @@ class Label(Enum):
         return result
 
 
-class UnconfiguredRepository(Exception):
-    pass
-
-
 @dataclass
-class Commit:
-    sha: str
-    message: str
-    fixes: set = field(default_factory=set)
-    refs: set = field(default_factory=set)
+class CheckResult:
+    # None when the check couldn't be completed yet
+    conclusion: Optional[str]
+    output: dict
+    # Internal errors are temporary and should be retried
+    cacheable: bool = True
 
     @property
-    def subject(self):
-        return self.message.splitlines()[0]
+    def success(self) -> bool:
+        return self.conclusion == 'success'
 
+    def matches(self, check_run: Mapping) -> bool:
+        return (check_run['status'] == 'completed' and check_run['conclusion'] == self.conclusion
+                and check_run['output'].get('title') == self.output['title']
+                and check_run['output'].get('summary') == self.output['summary'])
 
-@dataclass
-class Config:
-    project: Optional[str] = None
-    required: bool = False
-    refs: set = field(default_factory=set)
-    version_prefix: Optional[str] = None
-    apply_labels: bool = True
-
-
-# This should be handled cleaner
-with open(resource_filename(__name__, 'config/repos.yaml')) as config_fp:
-    CONFIG = {
-        repo: Config(project=config.get('redmine'), required=config.get('redmine_required', False),
-                     refs=set(config.get('refs', [])),
-                     version_prefix=config.get('redmine_version_prefix'))
-        for repo, config in yaml.safe_load(config_fp).items()
-    }
 
-with open(resource_filename(__name__, 'config/users.yaml')) as users_fp:
-    USERS = yaml.safe_load(users_fp)
+logger = logging.getLogger('prprocessor')  # pylint: disable=invalid-name
+
+CHECK_CACHE: TTLCache[tuple, CheckResult] = TTLCache(
+    maxsize=int(os.environ.get('CHECK_CACHE_SIZE', '512')),
+    ttl=float(os.environ.get('CHECK_CACHE_TTL', '300')),
+)
+# A push typically results in both a pull_request and a check_suite event
+CHECK_DEBOUNCER: Debouncer[tuple, Optional[bool]] = Debouncer(
+    delay=float(os.environ.get('CHECK_DEBOUNCE_DELAY', '1')),
+)
+JOB_SCHEDULER = JobScheduler(
+    concurrency=int(os.environ.get('JOB_CONCURRENCY', '8')),
+    max_queued=int(os.environ.get('JOB_QUEUE_SIZE', '1000')),
+)
+# Checks that couldn't be completed because Redmine was unavailable, by repository and PR number,
+# with the context they ran in
+UNAVAILABLE_CHECKS: dict[tuple[str, int], contextvars.Context] = {}
+_revalidation_task: Optional[asyncio.Task] = None  # pylint: disable=invalid-name
+
+CACHES: dict[str, TTLCache] = {
+    'checks': CHECK_CACHE,
+    'github_responses': GITHUB_CACHE.memory,
+    'commits': COMMIT_CACHE,
+    'redmine_issues': ISSUE_CACHE,
+    'redmine_projects': PROJECT_CACHE,
+    'redmine_versions': VERSION_CACHE,
+}
+
+REGISTRY.collector(
+    'prprocessor_queue_depth', 'Number of items waiting in each queue', 'gauge', ('queue',),
+    lambda: [(('jobs',), len(JOB_SCHEDULER)),
+             (('checks',), len(CHECK_DEBOUNCER)),
+             (('checks_waiting_for_redmine',), len(UNAVAILABLE_CHECKS)),
+             (('redmine_writes',), len(WRITE_BUFFER)),
+             (('github_rate_limit',), GITHUB_LIMITER.waiting),
+             (('redmine_rate_limit',), REDMINE_LIMITER.waiting)],
+)
+REGISTRY.collector(
+    'prprocessor_jobs_running', 'Number of events being processed', 'gauge', (),
+    lambda: [((), JOB_SCHEDULER.running)],
+)
+REGISTRY.collector(
+    'prprocessor_jobs_failed_total', 'Events that failed with an unhandled error', 'counter', (),
+    lambda: [((), JOB_SCHEDULER.failed)],
+)
+REGISTRY.collector(
+    'prprocessor_checks_coalesced_total', 'PR checks that were merged into a later check',
+    'counter', (), lambda: [((), CHECK_DEBOUNCER.coalesced)],
+)
+REGISTRY.collector(
+    'prprocessor_cache_hits_total', 'Cache lookups that found an entry', 'counter', ('cache',),
+    lambda: [((name,), cache.hits) for name, cache in CACHES.items()],
+)
+REGISTRY.collector(
+    'prprocessor_cache_misses_total', 'Cache lookups that found no entry', 'counter', ('cache',),
+    lambda: [((name,), cache.misses) for name, cache in CACHES.items()],
+)
+REGISTRY.collector(
+    'prprocessor_cache_hit_ratio', 'Fraction of cache lookups that found an entry', 'gauge',
+    ('cache',), lambda: [((name,), cache.hit_ratio) for name, cache in CACHES.items()],
+)
+REGISTRY.collector(
+    'prprocessor_cache_entries', 'Number of entries in each cache', 'gauge', ('cache',),
+    lambda: [((name,), len(cache)) for name, cache in CACHES.items()],
+)
+REGISTRY.collector(
+    'prprocessor_retries_total', 'Requests that were retried after a temporary error',
+    'counter', ('upstream',),
+    lambda: [((budget.name,), budget.retries)
+             for budget in (GITHUB_RETRY_BUDGET, REDMINE_RETRY_BUDGET)],
+)
+REGISTRY.collector(
+    'prprocessor_retry_budget_exhausted_total',
+    'Requests that were not retried because the retry budget was exhausted', 'counter',
+    ('upstream',),
+    lambda: [((budget.name,), budget.exhausted)
+             for budget in (GITHUB_RETRY_BUDGET, REDMINE_RETRY_BUDGET)],
+)
+REGISTRY.collector(
+    'prprocessor_rate_limited_requests_total', 'Requests that had to wait for the rate limiter',
+    'counter', ('upstream',),
+    lambda: [((limiter.name,), limiter.throttled)
+             for limiter in (GITHUB_LIMITER, REDMINE_LIMITER)],
+)
+REGISTRY.collector(
+    'prprocessor_upstream_available',
+    'Whether the circuit breaker allows requests, 0 while the upstream is considered down',
+    'gauge', ('upstream',), lambda: [((REDMINE_BREAKER.name,), int(REDMINE_BREAKER.available))],
+)
+
 
+def collect_redmine_connections() -> list[tuple[tuple[str], int]]:
+    stats = get_redmine_stats()
+    if stats is None:
+        return []
+    return [(('in_flight',), stats.in_flight), (('idle',), stats.idle)]
 
-logger = logging.getLogger('prprocessor')  # pylint: disable=invalid-name
+
+REGISTRY.collector('prprocessor_redmine_connections', 'Redmine connections by state', 'gauge',
+                   ('state',), collect_redmine_connections)
+RECONCILED_LINKS = REGISTRY.counter(
+    'prprocessor_reconciled_links_total',
+    'PR links in Redmine that were compared with GitHub by outcome', ('outcome',),
+)
 
 
-def get_config(repository: str) -> Config:
+async def github_call(method: str, *args, priority: Priority = Priority.NORMAL,
+                      policy: Optional[RetryPolicy] = None, **kwargs) -> Any:
+    """
+    Make a GitHub API call through the rate limiter. Completing check runs should use a high
+    priority while cosmetic changes like labels should use a low priority. Failures are retried
+    according to the policy, which defaults to GITHUB_RETRY for idempotent methods and no
+    retries otherwise.
+    """
+    if policy is None:
+        policy = GITHUB_RETRY if method in GITHUB_IDEMPOTENT_METHODS else NO_RETRY
+    github_api = get_github_api()
+    call = partial(getattr(github_api, method), *args, **kwargs)
     try:
-        return CONFIG[repository]
-    except KeyError:
-        user, _ = repository.split('/', 1)
-        if user not in WHITELISTED_ORGANIZATIONS:
-            logger.info('The repository %s is unconfigured and user %s not whitelisted',
-                        repository, user)
-            raise UnconfiguredRepository(f'The repository {repository} is unconfigured')
-        return Config(apply_labels=False)
+        with span(f'github.{method}', url=args[0] if args else ''):
+            return await call_with_retry(lambda: GITHUB_LIMITER.call(call, priority), policy,
+                                         GITHUB_RETRY_BUDGET)
+    finally:
+        update_github_rate_limit(github_api)
+
+
+def get_github_api():
+    """
+    The client of the current installation. octomachinery creates it without a cache, so the
+    response cache is added here.
+    """
+    github_api = RUNTIME_CONTEXT.app_installation_client
+    if getattr(github_api, '_cache', None) is None:
+        github_api._cache = GITHUB_CACHE  # pylint: disable=protected-access
+    return github_api
+
+
+def update_github_rate_limit(github_api) -> None:
+    rate_limit = getattr(github_api, 'rate_limit', None)
+    if rate_limit is not None:
+        GITHUB_LIMITER.update(rate_limit.remaining, rate_limit.reset_datetime.timestamp())
+
+
+def run_in_background(handler):
+    """
+    Queue the event on the job scheduler instead of processing it right away. Events are
+    grouped by repository so a busy repository doesn't delay the others.
+    """
+    @wraps(handler)
+    async def wrapper(**kwargs):
+        repository = kwargs.get('repository', {}).get('full_name')
+        await JOB_SCHEDULER.submit(repository, partial(process_event, handler, kwargs))
+    return wrapper
+
+
+def reject_when_busy(handler: Callable[[web.Request], Awaitable[web.StreamResponse]]) \
+        -> Callable[[web.Request], Awaitable[web.StreamResponse]]:
+    """
+    Answer webhooks with 503 Service Unavailable while the job queue is full. octomachinery
+    acknowledges a delivery before its handlers run, so this is the only point where the
+    delivery can still be refused, and GitHub then shows it as failed so it can be redelivered.
+    """
+    async def handle(request: web.Request) -> web.StreamResponse:
+        if JOB_SCHEDULER.full:
+            logger.warning('Rejecting delivery %s, too many events are queued',
+                           request.headers.get('X-GitHub-Delivery'))
+            return web.Response(status=503, text='Too many events are queued')
+        return await handler(request)
+    return handle
+
+
+async def process_event(handler, kwargs: dict[str, Any]) -> None:
+    """
+    Process the event in a trace of its own. The webhook delivery ID is used as the trace ID so
+    a trace can be found from GitHub's delivery log.
+    """
+    event = getattr(RUNTIME_CONTEXT, 'github_event', None)
+    delivery_id = getattr(event, 'delivery_id', None)
+    attributes = {
+        'action': kwargs.get('action', ''),
+        'repository': kwargs.get('repository', {}).get('full_name', ''),
+    }
+    if event is not None:
+        attributes['event'] = event.name
+    number = kwargs.get('number') or kwargs.get('pull_request', {}).get('number')
+    if number:
+        attributes['number'] = number
+
+    with start_trace(handler.__name__, delivery_id.hex if delivery_id else None, **attributes):
+        await record_event(handler.__name__, partial(handler, **kwargs))
 
 
 def pr_is_cherry_pick(pull_request: Mapping) -> bool:
@@ -121,8 +350,6 @@ def summarize(summary: Mapping[str, Iterable], show_headers: bool) -> Generator[
 
 async def update_pr_labels(pull_request: Mapping, labels_to_add: Iterable[Label],
                            labels_to_remove: Iterable[Label]) -> None:
-    github_api = RUNTIME_CONTEXT.app_installation_client
-
     tasks = []
 
     repository = pull_request['base']['repo']['full_name']
@@ -134,34 +361,110 @@ async def update_pr_labels(pull_request: Mapping, labels_to_add: Iterable[Label]
     if labels_to_add:
         logger.info('%s PR #%s: adding labels: %r', repository, pull_request['number'], labels_to_add)
         data = [label.value for label in labels_to_add]
-        tasks.append(github_api.post(url, data=data))
+        tasks.append(github_call('post', url, data=data, priority=Priority.LOW))
 
     for label in labels_to_remove:
         logger.info('%s PR #%s: removing label: %s', repository, pull_request['number'], label)
-        tasks.append(github_api.delete(url, url_vars={'name': label.value}))
+        tasks.append(github_call('delete', url, url_vars={'name': label.value},
+                                 priority=Priority.LOW))
 
     if tasks:
         await asyncio.gather(*tasks)
 
 
+async def iter_paginated(url: str, iterable_key: Optional[str] = None,
+                         page_size: int = GITHUB_PAGE_SIZE) -> AsyncGenerator[Any, None]:
+    """
+    Iterate over all items of a paginated endpoint. The next page is already fetched while the
+    caller processes the current one. When the caller stops early, fetching stops as well.
+
+    When fetching a page fails, it's retried from that page on so the items that were already
+    received aren't fetched again.
+    """
+    github_api = get_github_api()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=page_size)
+    done = object()
+    received = 0
+
+    async def fetch_remaining() -> None:
+        nonlocal received
+        page, skip = divmod(received, page_size)
+        position = page * page_size
+        kwargs = {'iterable_key': iterable_key} if iterable_key else {}
+        # Only the first page can go through the limiter, the rest follows directly
+        await GITHUB_LIMITER.acquire()
+        start = time.perf_counter()
+        try:
+            async for item in github_api.getiter(f'{url}{{?per_page,page}}',
+                                                 {'per_page': page_size, 'page': page + 1},
+                                                 **kwargs):
+                # The items of a page arrive together, so only the first one waited for it
+                if position % page_size == 0:
+                    record_request(GITHUB_LIMITER.name, 'ok', time.perf_counter() - start)
+                position += 1
+                if skip:
+                    skip -= 1
+                else:
+                    await queue.put(item)
+                    received += 1
+                start = time.perf_counter()
+        except Exception as exc:
+            record_request(GITHUB_LIMITER.name, type(exc).__name__, time.perf_counter() - start)
+            raise
+
+        if position == page * page_size:
+            record_request(GITHUB_LIMITER.name, 'ok', time.perf_counter() - start)
+
+    async def fetch() -> None:
+        try:
+            with span('github.getiter', url=url):
+                await call_with_retry(fetch_remaining, GITHUB_RETRY, GITHUB_RETRY_BUDGET)
+                set_attributes(items=received)
+        except Exception as exc:  # pylint: disable=broad-except
+            await queue.put(exc)
+        else:
+            await queue.put(done)
+        finally:
+            update_github_rate_limit(github_api)
+
+    task = asyncio.create_task(fetch())
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        task.cancel()
+
+
+def get_commits_url(pull_request: Mapping) -> tuple[str, Optional[str]]:
+    if pull_request.get('commits', 0) <= PR_COMMITS_LIMIT:
+        return pull_request['commits_url'], None
+
+    # The compare endpoint isn't limited, but wraps the commits in an object
+    base_sha = pull_request['base']['sha']
+    head_sha = pull_request['head']['sha']
+    return f'{pull_request["base"]["repo"]["url"]}/compare/{base_sha}...{head_sha}', 'commits'
+
+
 async def get_commits_from_pull_request(pull_request: Mapping) -> AsyncGenerator[Commit, None]:
-    github_api = RUNTIME_CONTEXT.app_installation_client
-    items = await github_api.getitem(pull_request['commits_url'])
-    for item in items:
-        commit = Commit(item['sha'], item['commit']['message'])
+    url, iterable_key = get_commits_url(pull_request)
+    async for item in iter_paginated(url, iterable_key):
+        yield parse_commit(item['sha'], item['commit']['message'])
 
-        match = COMMIT_VALID_SUMMARY_REGEX.match(commit.subject)
-        if match:
-            action = getattr(commit, match.group('action').lower())
-            for issue in COMMIT_ISSUES_REGEX.findall(match.group('issues')):
-                action.add(int(issue))
 
-        yield commit
+async def get_check_run(pull_request: Mapping) -> Optional[Mapping]:
+    """
+    The check run of the PR's head commit, if there is one
+    """
+    url = f'{pull_request["base"]["repo"]["url"]}/commits/{{sha}}/check-runs{{?check_name}}'
+    check_runs = await github_call('getitem', url, url_vars={'sha': pull_request['head']['sha'],
+                                                             'check_name': CHECK_NAME},
+                                   preview_api_version='antiope')
+    return next(iter(check_runs['check_runs']), None)
 
 
 async def set_check_in_progress(pull_request: Mapping, check_run=None):
-    github_api = RUNTIME_CONTEXT.app_installation_client
-
     data = {
         'name': CHECK_NAME,
         'head_branch': pull_request['head']['ref'],
@@ -172,10 +475,10 @@ async def set_check_in_progress(pull_request: Mapping, check_run=None):
 
     if check_run:
         if check_run['status'] != 'in_progress':
-            await github_api.patch(check_run['url'], data=data, preview_api_version='antiope')
+            await github_call('patch', check_run['url'], data=data, preview_api_version='antiope')
     else:
         url = f'{pull_request["base"]["repo"]["url"]}/check-runs'
-        check_run = await github_api.post(url, data=data, preview_api_version='antiope')
+        check_run = await github_call('post', url, data=data, preview_api_version='antiope')
 
     return check_run
 
@@ -204,57 +507,99 @@ def format_details(invalid_issues: Iterable[Issue], correct_project: Project) ->
     return '\n'.join(text)
 
 
-async def get_issues_from_pr(pull_request: Mapping) -> tuple[IssueValidation, Collection]:
-    config = get_config(pull_request['base']['repo']['full_name'])
+class StageTimer:
+    """
+    Records how long each stage of an operation took, both for the log and the metrics
+    """
 
-    issue_ids = set()
-    invalid_commits = []
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.timings: dict[str, float] = {}
 
-    async for commit in get_commits_from_pull_request(pull_request):
-        issue_ids.update(commit.fixes)
-        issue_ids.update(commit.refs)
-        if config.required and not commit.fixes and not commit.refs:
-            invalid_commits.append(commit)
+    @contextmanager
+    def stage(self, name: str) -> Generator[None, None, None]:
+        start = time.perf_counter()
+        try:
+            with span(f'{self.operation}.{name}'):
+                yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+            STAGE_DURATION.labels(self.operation, name).observe(self.timings[name])
 
-    return verify_issues(config, issue_ids), invalid_commits
+    def __str__(self) -> str:
+        return ', '.join(f'{name} {duration * 1000:.1f}ms'
+                         for name, duration in self.timings.items())
 
 
-async def run_pull_request_check(pull_request: Mapping, check_run=None) -> bool:
-    github_api = RUNTIME_CONTEXT.app_installation_client
+async def get_issues_from_pr(pull_request: Mapping, timer: StageTimer) \
+        -> tuple[Optional[IssueValidation], Collection]:
+    """
+    The cheap stages run first. When they find invalid commits the check fails regardless of
+    the issues, so Redmine isn't queried at all and None is returned instead of the issues.
 
-    check_run = await set_check_in_progress(pull_request, check_run)
+    Every GitHub and Redmine call made here is retried by itself, so a failure late in the
+    process doesn't require fetching the commits again.
+    """
+    with timer.stage('config'):
+        config = get_config(pull_request['base']['repo']['full_name'])
+
+    with timer.stage('commits'):
+        commits = [commit async for commit in get_commits_from_pull_request(pull_request)]
+
+    with timer.stage('format'):
+        issue_ids = set()
+        invalid_commits = []
+        for commit in commits:
+            issue_ids.update(commit.fixes)
+            issue_ids.update(commit.refs)
+            if config.required and not commit.fixes and not commit.refs:
+                invalid_commits.append(commit)
+
+    if invalid_commits:
+        return None, invalid_commits
 
+    with timer.stage('redmine'):
+        return await verify_issues(config, issue_ids), invalid_commits
+
+
+async def validate_pull_request(pull_request: Mapping, update_redmine: bool = True) \
+        -> CheckResult:
     # We're very pessimistic
     conclusion = 'failure'
 
-    attempts = 3
-
+    timer = StageTimer('check')
     try:
-        for attempt in range(1, attempts + 1):
-            try:
-                issue_results, invalid_commits = await get_issues_from_pr(pull_request)
-                break
-            except:  # pylint: disable=bare-except
-                if attempt == attempts:
-                    raise
-                logger.exception('Failure during validation of PR (attempt %s)', attempt)
-                await asyncio.sleep(attempt)
+        issue_results, invalid_commits = await get_issues_from_pr(pull_request, timer)
     except UnconfiguredRepository:
         output = {
             'title': 'Unknown repository',
             'summary': 'Contact us via [Discourse](https://community.theforeman.org]',
         }
-    except:  # pylint: disable=bare-except
+    except Exception as exc:  # pylint: disable=broad-except
+        if is_unavailable(exc):
+            logger.warning('Unable to validate PR, Redmine is unavailable: %s', exc)
+            return CheckResult(None, {
+                'title': 'Redmine unavailable',
+                'summary': 'The check will run again once Redmine is available',
+            }, cacheable=False)
+
         logger.exception('Failure during validation of PR')
-        output = {
+        return CheckResult(conclusion, {
             'title': 'Internal error while testing',
             'summary': 'Please retry later',
-        }
+        }, cacheable=False)
     else:
-        try:
-            await update_redmine_on_issues(pull_request, issue_results.valid_issues)
-        except:  # pylint: disable=bare-except
-            logger.exception('Failed to update Redmine issues')
+        redmine_skipped = issue_results is None
+        if redmine_skipped:
+            issue_results = IssueValidation(project=None, valid_issues=set(),
+                                            invalid_project_issues=set(), missing_issue_ids=set())
+
+        if update_redmine:
+            with timer.stage('update'):
+                try:
+                    await update_redmine_on_issues(pull_request, issue_results.valid_issues)
+                except:  # pylint: disable=bare-except
+                    logger.exception('Failed to update Redmine issues')
 
         summary: dict[str, Collection] = {
             'Invalid commits': format_invalid_commit_messages(invalid_commits),
@@ -273,71 +618,163 @@ async def run_pull_request_check(pull_request: Mapping, check_run=None) -> bool:
             'summary': '\n'.join(summarize(summary, multiple_sections)),
             'text': format_details(issue_results.invalid_project_issues, issue_results.project),
         }
+        if redmine_skipped:
+            output['summary'] += '\n\nRedmine issues are verified once all commits are valid.'
 
-        # > For 'properties/text', nil is not a string.
-        # That means it's not possible to delete the text by setting None, but
-        # sometimes we can avoid setting it
-        if not output['text'] and not check_run['output'].get('text'):
-            del output['text']
-
-    await github_api.patch(
-        check_run['url'],
-        preview_api_version='antiope',
-        data={
-            'status': 'completed',
-            'head_branch': pull_request['head']['ref'],
-            'head_sha': pull_request['head']['sha'],
-            'completed_at': datetime.now(tz=timezone.utc).isoformat(),
-            'conclusion': conclusion,
-            'output': output,
-        },
-    )
+    logger.info('Validated %s PR #%s: %s', pull_request['base']['repo']['full_name'],
+                pull_request['number'], timer)
 
-    return conclusion == 'success'
+    return CheckResult(conclusion, output)
+
+
+def get_check_cache_key(pull_request: Mapping) -> Optional[tuple]:
+    repository = pull_request['base']['repo']['full_name']
+    snapshot = CONFIG_STORE.snapshot
+    try:
+        snapshot.get_config(repository)
+    except UnconfiguredRepository:
+        return None
+
+    # A changed config results in a different key
+    return (repository, pull_request['number'], pull_request['head']['sha'],
+            snapshot.get_digest(repository))
+
+
+async def revalidate_when_available() -> None:
+    """
+    Run the checks that couldn't be completed again once Redmine is available
+    """
+    global _revalidation_task  # pylint: disable=global-statement,invalid-name
+    try:
+        # Redmine may have failed fewer times than it takes to open the breaker
+        await asyncio.sleep(REDMINE_BREAKER.reset_timeout)
+        await wait_until_available()
+    finally:
+        _revalidation_task = None
+
+    pending = list(UNAVAILABLE_CHECKS.items())
+    UNAVAILABLE_CHECKS.clear()
+    logger.info('Redmine is available again, checking %s PRs', len(pending))
+    for (repository, number), context in pending:
+        job = partial(recheck_pull_request, repository, number)
+        # The job needs the GitHub client of the event it came from
+        await context.run(asyncio.create_task, JOB_SCHEDULER.submit(repository, job))
+
+
+async def recheck_pull_request(repository: str, number: int) -> None:
+    """
+    Run a check that couldn't be completed again. The PR may have been pushed to in the
+    meantime, so it's fetched again and only checked if its head has no completed check run.
+    """
+    pull_request = await github_call('getitem', f'/repos/{repository}/pulls/{number}')
+    if pull_request['state'] != 'open':
+        logger.info('Not checking %s PR #%s again, it was closed', repository, number)
+        return
+
+    check_run = await get_check_run(pull_request)
+    if check_run is not None and check_run['status'] == 'completed':
+        logger.info('Not checking %s PR #%s again, %s was checked since', repository, number,
+                    pull_request['head']['sha'])
+        return
+
+    await schedule_pull_request_check(pull_request, check_run, use_cache=False)
+
+
+def revalidate_later(pull_request: Mapping) -> None:
+    global _revalidation_task  # pylint: disable=global-statement,invalid-name
+    key = (pull_request['base']['repo']['full_name'], pull_request['number'])
+    UNAVAILABLE_CHECKS[key] = contextvars.copy_context()
+    if _revalidation_task is None:
+        _revalidation_task = asyncio.create_task(revalidate_when_available())
+
+
+async def run_pull_request_check(pull_request: Mapping, check_run=None,
+                                 use_cache: bool = True) -> Optional[bool]:
+    """
+    Validate the PR and report the result in a check run. Results are cached by head SHA so
+    duplicate events don't validate again. A rerequested check should bypass the cache since
+    something may have changed in Redmine.
+
+    When Redmine is unavailable the check run stays queued and None is returned. It's completed
+    once Redmine is available again.
+    """
+    cache_key = get_check_cache_key(pull_request)
+    result = CHECK_CACHE.get(cache_key) if use_cache and cache_key else None
+
+    if result is not None:
+        if check_run and check_run['head_sha'] == pull_request['head']['sha'] and \
+                result.matches(check_run):
+            logger.info('Check run for %s PR #%s is up to date', cache_key[0], cache_key[1])
+            return result.success
+        check_run = await set_check_in_progress(pull_request, check_run)
+    else:
+        check_run = await set_check_in_progress(pull_request, check_run)
+        result = await validate_pull_request(pull_request)
+        if cache_key and result.cacheable:
+            CHECK_CACHE.set(cache_key, result)
+
+    return await complete_check_run(pull_request, check_run, result)
+
+
+async def complete_check_run(pull_request: Mapping, check_run: Mapping,
+                             result: CheckResult) -> Optional[bool]:
+    output = dict(result.output)
+    # > For 'properties/text', nil is not a string.
+    # That means it's not possible to delete the text by setting None, but
+    # sometimes we can avoid setting it
+    if 'text' in output and not output['text'] and not check_run['output'].get('text'):
+        del output['text']
+
+    data = {
+        'status': 'completed',
+        'head_branch': pull_request['head']['ref'],
+        'head_sha': pull_request['head']['sha'],
+        'completed_at': datetime.now(tz=timezone.utc).isoformat(),
+        'conclusion': result.conclusion,
+        'output': output,
+    }
+    if result.conclusion is None:
+        data = {key: data[key] for key in ('head_branch', 'head_sha', 'output')}
+        data['status'] = 'queued'
+        revalidate_later(pull_request)
+
+    await github_call('patch', check_run['url'], priority=Priority.HIGH,
+                      preview_api_version='antiope', data=data)
+
+    return None if result.conclusion is None else result.success
+
+
+async def schedule_pull_request_check(pull_request: Mapping, check_run=None,
+                                      use_cache: bool = True) -> Optional[bool]:
+    """
+    Run the PR check after a short delay. Events for the same PR that arrive in the meantime are
+    coalesced so only the most recent version of the PR is processed. Webhooks can be delivered
+    out of order, so an event doesn't replace one for a newer head commit.
+    """
+    key = (pull_request['base']['repo']['full_name'], pull_request['number'])
+    # Pushing a commit updates the PR, and GitHub's timestamps compare correctly as strings
+    return await CHECK_DEBOUNCER.submit(key, partial(run_pull_request_check, pull_request,
+                                                     check_run, use_cache),
+                                        version=pull_request['updated_at'])
 
 
 async def update_redmine_on_issues(pull_request: Mapping, issues: Iterable[Issue]) -> None:
-    pr_url = pull_request['html_url']
-    assignee = USERS.get(pull_request['user']['login'])
-
-    for issue in issues:
-        status = Status(issue.status.id)
-
-        if not status.is_rejected():
-            updates = {}
-            # TODO: rewrite this
-            #if issue.backlog or issue.recycle_bin or not issue.fixed_version_id:
-            #    triaged_field = issue.custom_fields.get(Field.TRIAGED)
-            #    if triaged_field.value is True:  # TODO does the API return a boolean?
-            #        updates['custom_fields'] = [{'id': triaged_field.id, 'value': False}]
-
-            #    updates['fixed_version_id'] = None
-
-            if not pr_is_cherry_pick(pull_request):
-                pr_field = issue.custom_fields.get(Field.PULL_REQUEST)
-                if pr_url not in pr_field.value:
-                    if 'custom_fields' not in updates:
-                        updates['custom_fields'] = []
-                    new_value = pr_field.value + [pr_url]
-                    updates['custom_fields'].append({'id': pr_field.id, 'value': new_value})
-
-            if assignee and not hasattr(issue, 'assigned_to'):
-                updates['assigned_to_id'] = assignee
-
-            if not (status.is_closed() or status == Status.READY_FOR_TESTING):
-                updates['status_id'] = Status.READY_FOR_TESTING.value
-
-            if updates:
-                logger.info('Updating issue %s: %s', issue.id, updates)
-                issue.save(**updates)
-            else:
-                logger.debug('Redmine issue %s already in sync', issue.id)
+    issues = list(issues)
+    # Cherry picks are not linked since the original PR already is
+    pr_url = None if pr_is_cherry_pick(pull_request) else pull_request['html_url']
+    assignee = CONFIG_STORE.snapshot.users.get(pull_request['user']['login'])
+
+    mutations = [Mutation(issue.id, Action.LINK_PULL_REQUEST, pull_request=pr_url,
+                          assignee=assignee)
+                 for issue in issues]
+    await update_issues(issues, mutations)
 
 
 @process_event_actions('pull_request', {'opened', 'ready_for_review', 'reopened', 'synchronize'})
 @process_webhook_payload
+@run_in_background
 async def on_pr_modified(*, action: str, pull_request: Mapping, **_kw) -> None:
-    commits_valid_style = await run_pull_request_check(pull_request)
+    commits_valid_style = await schedule_pull_request_check(pull_request)
 
     try:
         config = get_config(pull_request['base']['repo']['full_name'])
@@ -358,7 +795,8 @@ async def on_pr_modified(*, action: str, pull_request: Mapping, **_kw) -> None:
         if Label.NOT_YET_REVIEWED not in labels:
             labels.add(Label.NEEDS_RE_REVIEW)
 
-    if not commits_valid_style:
+    # Unknown while Redmine is unavailable
+    if commits_valid_style is False:
         labels.add(Label.WAITING_ON_CONTRIBUTOR)
 
     # TODO: handle None value (result is being calculated by GH) and resubmit later?
@@ -385,6 +823,7 @@ async def on_pr_modified(*, action: str, pull_request: Mapping, **_kw) -> None:
 
 @process_event_actions('pull_request_review', {'submitted'})
 @process_webhook_payload
+@run_in_background
 async def on_pr_review_assign_labels(*, pull_request: Mapping, review: Mapping, **_kw) -> None:
     labels_before = Label.load_labels(label['name'] for label in pull_request['labels'])
     labels = labels_before.copy()
@@ -406,26 +845,42 @@ async def on_pr_review_assign_labels(*, pull_request: Mapping, review: Mapping,
     await update_pr_labels(pull_request, labels_to_add, labels_to_remove)
 
 
+async def check_pull_requests(pr_summaries: Iterable[Mapping], check_run=None,
+                              use_cache: bool = True) -> None:
+    """
+    Check multiple PRs concurrently. A failure in one PR doesn't affect the others.
+    """
+    semaphore = asyncio.Semaphore(PR_CONCURRENCY)
+
+    async def check(pr_summary: Mapping) -> None:
+        async with semaphore:
+            pull_request = await github_call('getitem', pr_summary['url'])
+            await schedule_pull_request_check(pull_request, check_run, use_cache)
+
+    pr_summaries = list(pr_summaries)
+    results = await asyncio.gather(*(check(pr_summary) for pr_summary in pr_summaries),
+                                   return_exceptions=True)
+    for pr_summary, result in zip(pr_summaries, results):
+        if isinstance(result, Exception):
+            logger.error('Failed to check PR %s', pr_summary['url'], exc_info=result)
+
+
 @process_event_actions('check_run', {'rerequested'})
 @process_webhook_payload
+@run_in_background
 async def on_check_run(*, check_run: Mapping, **_kw) -> None:
-    github_api = RUNTIME_CONTEXT.app_installation_client
-
     if not check_run['pull_requests']:
         logger.warning('Received check_run without PRs')
 
-    for pr_summary in check_run['pull_requests']:
-        pull_request = await github_api.getitem(pr_summary['url'])
-        await run_pull_request_check(pull_request, check_run)
+    await check_pull_requests(check_run['pull_requests'], check_run, use_cache=False)
 
 
 @process_event_actions('check_suite', {'requested', 'rerequested'})
 @process_webhook_payload
-async def on_suite_run(*, check_suite: Mapping, **_kw) -> None:
-    github_api = RUNTIME_CONTEXT.app_installation_client
-
-    check_runs = await github_api.getitem(check_suite['check_runs_url'],
-                                          preview_api_version='antiope')
+@run_in_background
+async def on_suite_run(*, action: str, check_suite: Mapping, **_kw) -> None:
+    check_runs = await github_call('getitem', check_suite['check_runs_url'],
+                                   preview_api_version='antiope')
 
     for check_run in check_runs['check_runs']:
         if check_run['name'] == CHECK_NAME:
@@ -436,13 +891,13 @@ async def on_suite_run(*, check_suite: Mapping, **_kw) -> None:
     if not check_suite['pull_requests']:
         logger.warning('Received check_suite without PRs')
 
-    for pr_summary in check_suite['pull_requests']:
-        pull_request = await github_api.getitem(pr_summary['url'])
-        await run_pull_request_check(pull_request, check_run)
+    await check_pull_requests(check_suite['pull_requests'], check_run,
+                              use_cache=action == 'requested')
 
 
 @process_event_actions('pull_request', {'closed'})
 @process_webhook_payload
+@run_in_background
 async def on_pr_merge(*, pull_request: Mapping, **_kw) -> None:
     """
     Only acts on merged PRs to a master or develop branch. There is no handling for stable
@@ -454,6 +909,11 @@ async def on_pr_merge(*, pull_request: Mapping, **_kw) -> None:
     the fixed_in_version.
     """
 
+    # Closing unlinks the issues, so the PR must be validated again if it's reopened
+    cache_key = get_check_cache_key(pull_request)
+    if cache_key:
+        CHECK_CACHE.invalidate(cache_key)
+
     repository = pull_request['base']['repo']['full_name']
     try:
         config = get_config(repository)
@@ -464,13 +924,16 @@ async def on_pr_merge(*, pull_request: Mapping, **_kw) -> None:
         logger.info('Repository for %s not found', repository)
         return
 
-    issue_ids = set()
-    async for commit in get_commits_from_pull_request(pull_request):
-        issue_ids.update(commit.fixes)
+    timer = StageTimer('merge')
+    with timer.stage('commits'):
+        issue_ids = set()
+        async for commit in get_commits_from_pull_request(pull_request):
+            issue_ids.update(commit.fixes)
 
     if issue_ids:
         redmine = get_redmine()
-        project = redmine.project.get(config.project)
+        with timer.stage('project'):
+            project = await get_project(redmine, config.project)
 
         if pull_request['merged']:
             target_branch = pull_request['base']['ref']
@@ -483,38 +946,465 @@ async def on_pr_merge(*, pull_request: Mapping, **_kw) -> None:
             if config.version_prefix:
                 version_prefix = f'{config.version_prefix}{version_prefix}'
 
-            fixed_in_version = get_latest_open_version(project, version_prefix)
+            with timer.stage('version'):
+                fixed_in_version = await get_latest_open_version(project, version_prefix)
 
             if not fixed_in_version:
                 logger.info('Unable to determine latest version for %s; prefix=%s', project.name,
                             version_prefix)
                 return
 
-            for issue in get_issues(redmine, issue_ids):
-                if issue.project.id == project.id:
-                    logger.info('Setting fixed in version for issue %s to %s', issue.id,
-                                fixed_in_version.name)
-                    set_fixed_in_version(issue, fixed_in_version)
+            with timer.stage('issues'):
+                issues = [issue for issue in await get_issues(redmine, issue_ids)
+                          if issue.project.id == project.id]
+            for issue in issues:
+                logger.info('Setting fixed in version for issue %s to %s', issue.id,
+                            fixed_in_version.name)
+            with timer.stage('update'):
+                await update_issues(issues, [Mutation(issue.id, Action.SET_FIXED_IN_VERSION,
+                                                      version_id=fixed_in_version.id)
+                                             for issue in issues])
         else:
             pr_url = pull_request['html_url']
 
-            for issue in get_issues(redmine, issue_ids):
-                pr_field = issue.custom_fields.get(Field.PULL_REQUEST)
-                try:
-                    new_value = pr_field.value.remove(pr_url)
-                except ValueError:
+            issues = []
+            with timer.stage('issues'):
+                linked_issues = await get_issues(redmine, issue_ids)
+            for issue in linked_issues:
+                if pr_url in issue.custom_fields.get(Field.PULL_REQUEST).value:
+                    logger.info('Removing PR %s from issue %s', pr_url, issue.id)
+                    issues.append(issue)
+                else:
                     logger.debug('Issue %s not linked to PR %s', issue.id, pr_url)
+
+            with timer.stage('update'):
+                await update_issues(issues, [Mutation(issue.id, Action.UNLINK_PULL_REQUEST,
+                                                      pull_request=pr_url)
+                                             for issue in issues])
+
+    logger.info('Processed closed %s PR #%s: %s', repository, pull_request['number'], timer)
+
+
+class Progress:
+    """
+    Remembers which PRs were revalidated at which head SHA, so an interrupted run can continue
+    where it stopped. Without a path nothing is remembered.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.done: dict[str, str] = {}
+        if path and os.path.exists(path):
+            with open(path) as progress_fp:
+                for line in progress_fp:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line that was being written when the run was interrupted
+                        continue
+                    self.done[entry['pull_request']] = entry['sha']
+
+    @staticmethod
+    def get_key(pull_request: Mapping) -> str:
+        return f'{pull_request["base"]["repo"]["full_name"]}#{pull_request["number"]}'
+
+    def is_done(self, pull_request: Mapping) -> bool:
+        return self.done.get(self.get_key(pull_request)) == pull_request['head']['sha']
+
+    def record(self, pull_request: Mapping, outcome: str) -> None:
+        key = self.get_key(pull_request)
+        self.done[key] = pull_request['head']['sha']
+        if self.path:
+            with open(self.path, 'a') as progress_fp:
+                progress_fp.write(json.dumps({'pull_request': key,
+                                              'sha': pull_request['head']['sha'],
+                                              'outcome': outcome}) + '\n')
+
+
+async def revalidate_pull_request(pull_request: Mapping, dry_run: bool = False) -> str:
+    """
+    Check the PR again and update its check run if the result changed. Returns the outcome.
+    """
+    check_run = await get_check_run(pull_request)
+
+    result = await validate_pull_request(pull_request, update_redmine=not dry_run)
+    if result.conclusion is None:
+        return 'unavailable'
+    if not result.cacheable:
+        # An internal error says nothing about the PR, so the check run is left as it is
+        logger.warning('Failed to validate %s PR #%s, leaving its check run',
+                       pull_request['base']['repo']['full_name'], pull_request['number'])
+        return 'failed'
+    if check_run is not None and result.matches(check_run):
+        return 'unchanged'
+    if dry_run:
+        logger.info('%s PR #%s would change from %s to %s',
+                    pull_request['base']['repo']['full_name'], pull_request['number'],
+                    check_run['conclusion'] if check_run else 'no check', result.conclusion)
+        return 'changed'
+
+    check_run = await set_check_in_progress(pull_request, check_run)
+    await complete_check_run(pull_request, check_run, result)
+    return 'updated'
+
+
+async def get_installation_clients(github_app: GitHubApp,
+                                   repositories: Iterable[str]) -> dict[str, Any]:
+    """
+    Return the API client of the installation for every repository the app is installed in
+    """
+    installations: dict[int, Any] = {}
+    clients = {}
+    for repository in repositories:
+        try:
+            installation = await github_app.api_client.getitem(
+                f'/repos/{repository}/installation', preview_api_version='machine-man')
+        except BadRequest as exc:
+            logger.warning('Skipping %s, the app is not installed: %s', repository, exc)
+            continue
+
+        if installation['id'] not in installations:
+            installations[installation['id']] = \
+                await github_app.get_installation_by_id(installation['id'])
+        clients[repository] = installations[installation['id']].api_client
+    return clients
+
+
+async def revalidate(config: BotAppConfig, repositories: Collection[str], concurrency: int,
+                     progress_path: Optional[str] = None, dry_run: bool = False) -> bool:
+    """
+    Check all open PRs in the repositories again. Redmine issues and projects are cached across
+    PRs, so issues that are referenced by multiple PRs are only fetched once.
+
+    Returns whether all PRs could be checked.
+    """
+    progress = Progress(progress_path)
+    outcomes: Counter[str] = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.monotonic()
+
+    async def revalidate_one(pr_summary: Mapping) -> None:
+        if progress.is_done(pr_summary):
+            outcomes['skipped'] += 1
+            return
+
+        async with semaphore:
+            key = Progress.get_key(pr_summary)
+            with start_trace('revalidate', pull_request=key):
+                try:
+                    # The listing lacks details like the number of commits
+                    pull_request = await github_call('getitem', pr_summary['url'])
+                    outcome = await revalidate_pull_request(pull_request, dry_run)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Failed to revalidate %s', key)
+                    outcome = 'failed'
                 else:
-                    logger.info('Removing PR %s from issue %s', pr_url, issue.id)
-                    issue.save(custom_fields=[{'id': pr_field.id, 'value': new_value}])
+                    if outcome in ('unchanged', 'updated') and not dry_run:
+                        progress.record(pull_request, outcome)
+                set_attributes(outcome=outcome)
+
+        outcomes[outcome] += 1
+        total = sum(outcomes.values())
+        if total % 50 == 0:
+            logger.info('Revalidated %s PRs in %.0f seconds: %s', total, time.monotonic() - start,
+                        dict(outcomes))
+
+    async def revalidate_repository(repository: str, client) -> None:
+        # Runs in a task of its own, so this only applies to the PRs of this repository
+        RUNTIME_CONTEXT.app_installation_client = client
+        try:
+            pr_summaries = [pr async for pr in iter_paginated(f'/repos/{repository}/pulls')]
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Failed to list the open PRs of %s', repository)
+            outcomes['failed'] += 1
+            return
+
+        logger.info('Found %s open PRs in %s', len(pr_summaries), repository)
+        await asyncio.gather(*(revalidate_one(pr_summary) for pr_summary in pr_summaries))
+
+    async with ClientSession() as http_session:
+        github_app = GitHubApp(config.github, http_session=http_session)
+        clients = await get_installation_clients(github_app, repositories)
+        await asyncio.gather(*(revalidate_repository(repository, client)
+                               for repository, client in clients.items()))
+        await flush_updates()
+        await close_exporters()
+
+    logger.info('Revalidated %s PRs in %.0f seconds: %s', sum(outcomes.values()),
+                time.monotonic() - start, dict(outcomes))
+    return not outcomes['failed'] and not outcomes['unavailable']
+
+
+class LinkReconciler:
+    """
+    Corrects the PR links in Redmine for when events were missed. Links to PRs that were closed
+    without being merged are removed, and the issues of open PRs are linked. Every run compares
+    the next batch of linked issues and validates the next batch of open PRs, so a large backlog
+    is worked through over multiple runs instead of at once.
+    """
+
+    def __init__(self, github_app: GitHubApp, batch_size: int = RECONCILE_BATCH_SIZE):
+        self.github_app = github_app
+        self.batch_size = batch_size
+        self.offset = 0
+        self.repository_index = 0
+        self._clients: dict[str, Any] = {}
+        # Open PRs by head commit that were validated, which linked their issues
+        self._validated: TTLCache[tuple[str, int, str], bool] = TTLCache(
+            maxsize=int(os.environ.get('RECONCILE_CACHE_SIZE', '16384')), ttl=float('inf'))
+        # A merged PR stays merged, so it's never looked up again
+        self._merged: TTLCache[str, bool] = TTLCache(
+            maxsize=int(os.environ.get('RECONCILE_CACHE_SIZE', '16384')), ttl=float('inf'))
+
+    async def _get_client(self, repository: str) -> Any:
+        if repository not in self._clients:
+            clients = await get_installation_clients(self.github_app, [repository])
+            # Remember repositories the app isn't installed in as well
+            self._clients[repository] = clients.get(repository)
+        return self._clients[repository]
+
+    async def _find_stale(self, repository: str, urls: dict[int, str]) -> list[str]:
+        """
+        Return the URLs of the PRs that were closed without being merged. The open PRs are listed
+        in bulk, only the closed ones are looked up one by one.
+        """
+        RUNTIME_CONTEXT.app_installation_client = await self._get_client(repository)
+        if RUNTIME_CONTEXT.app_installation_client is None:
+            return []
+
+        open_numbers = {pull_request['number'] async for pull_request
+                        in iter_paginated(f'/repos/{repository}/pulls')}
+        RECONCILED_LINKS.labels('open').inc(len(open_numbers & urls.keys()))
+
+        stale = []
+        for number, url in sorted(urls.items()):
+            if number in open_numbers:
+                continue
+            try:
+                pull_request = await github_call('getitem',
+                                                 f'/repos/{repository}/pulls/{number}',
+                                                 priority=Priority.LOW)
+            except BadRequest as exc:
+                logger.debug('Failed to look up %s: %s', url, exc)
+                RECONCILED_LINKS.labels('unknown').inc()
+                continue
+
+            if pull_request['merged']:
+                self._merged.set(url, True)
+                RECONCILED_LINKS.labels('merged').inc()
+            elif pull_request['state'] == 'closed':
+                stale.append(url)
+                RECONCILED_LINKS.labels('stale').inc()
+            else:
+                # Opened after the PRs were listed
+                RECONCILED_LINKS.labels('open').inc()
+        return stale
+
+    async def run(self) -> None:
+        issues, total = await get_linked_issues(get_redmine(), self.offset, self.batch_size)
+        set_attributes(offset=self.offset, issues=len(issues), total=total)
+        # Start over once every linked issue was compared
+        self.offset = self.offset + len(issues) if self.offset + len(issues) < total else 0
+
+        urls_by_repository: dict[str, dict[int, str]] = {}
+        for issue in issues:
+            for url in issue.custom_fields.get(Field.PULL_REQUEST).value:
+                parsed = parse_pull_request_url(url)
+                if parsed is None or url in self._merged:
+                    continue
+                repository, number = parsed
+                try:
+                    get_config(repository)
+                except UnconfiguredRepository:
+                    continue
+                urls_by_repository.setdefault(repository, {})[number] = url
+
+        # Every repository is compared in a task of its own with its own GitHub client
+        results = await asyncio.gather(*(self._find_stale(repository, urls)
+                                         for repository, urls in urls_by_repository.items()),
+                                       return_exceptions=True)
+        stale: set[str] = set()
+        for repository, result in zip(urls_by_repository, results):
+            if isinstance(result, Exception):
+                logger.error('Failed to compare the PR links of %s', repository, exc_info=result)
+            else:
+                stale.update(result)
+
+        mutations = [Mutation(issue.id, Action.UNLINK_PULL_REQUEST, pull_request=url)
+                     for issue in issues
+                     for url in issue.custom_fields.get(Field.PULL_REQUEST).value
+                     if url in stale]
+        for mutation in mutations:
+            logger.info('Removing closed PR %s from issue %s', mutation.pull_request,
+                        mutation.issue_id)
+        await update_issues(issues, mutations)
+
+        logger.info('Compared %s of %s issues linked to PRs, removed %s links to closed PRs',
+                    len(issues), total, len(mutations))
+
+        validated = await self._link_open()
+        logger.info('Validated %s open PRs to link their issues', validated)
+
+    async def _link_open(self) -> int:
+        """
+        Validate open PRs whose head commit wasn't validated yet, which links their issues, and
+        return how many were validated. The repositories are gone through in turn and a run
+        stops after the batch size, so the next run continues where it stopped.
+        """
+        repositories = sorted(CONFIG_STORE.snapshot.repositories)
+        start = self.repository_index if self.repository_index < len(repositories) else 0
+        validated = 0
+        for index in range(start, start + len(repositories)):
+            repository = repositories[index % len(repositories)]
+            RUNTIME_CONTEXT.app_installation_client = await self._get_client(repository)
+            if RUNTIME_CONTEXT.app_installation_client is None:
+                continue
+
+            try:
+                pr_summaries = [pr_summary async for pr_summary
+                                in iter_paginated(f'/repos/{repository}/pulls')]
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Failed to list the open PRs of %s', repository)
+                continue
+
+            for pr_summary in pr_summaries:
+                key = (repository, pr_summary['number'], pr_summary['head']['sha'])
+                if key in self._validated:
+                    continue
+                if validated >= self.batch_size:
+                    self.repository_index = index % len(repositories)
+                    return validated
+
+                validated += 1
+                try:
+                    # The listing lacks details like the number of commits
+                    pull_request = await github_call('getitem', pr_summary['url'],
+                                                     priority=Priority.LOW)
+                    result = await validate_pull_request(pull_request)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Failed to validate %s PR #%s', repository,
+                                     pr_summary['number'])
+                    continue
+
+                # Otherwise it's validated again next time
+                if result.conclusion is not None and result.cacheable:
+                    self._validated.set(key, True)
+
+        self.repository_index = 0
+        return validated
+
+    async def run_periodically(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if not REDMINE_BREAKER.available:
+                logger.info('Not comparing PR links while Redmine is unavailable')
+                continue
+            with start_trace('reconcile_links'):
+                try:
+                    await self.run()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Failed to compare PR links')
+
+
+def reload_config() -> None:
+    """
+    Reload the configuration on request. Cached Redmine projects and versions are dropped as
+    well, so a version that was just opened can be used right away.
+    """
+    CONFIG_STORE.reload()
+    invalidate_caches()
+
+
+async def serve(config: BotAppConfig) -> None:
+    try:
+        await replay_journal(get_redmine())
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Failed to replay the Redmine journal')
+
+    # The same startup logging as octomachinery's own runner
+    logger.debug('The GitHub App env is set to `%s`', config.runtime.env)
+    log_webhook_secret_status(config.github.webhook_secret)
+
+    JOB_SCHEDULER.start()
+    if CONFIG_RELOAD_INTERVAL > 0:
+        config_watcher = asyncio.create_task(CONFIG_STORE.watch(CONFIG_RELOAD_INTERVAL,
+                                                                on_change=invalidate_caches))
+
+    async with ClientSession() as http_session:
+        github_app = GitHubApp(config.github, http_session=http_session)
+        await github_app.log_installs_list()
+        if RECONCILE_INTERVAL > 0:
+            reconciler = asyncio.create_task(
+                LinkReconciler(github_app).run_periodically(RECONCILE_INTERVAL))
+        # The same handler as octomachinery's setup_server_runner(), behind the queue limit
+        runner = await get_server_runner(reject_when_busy(partial(
+            route_github_webhook_event, github_app=github_app,
+            webhook_secret=config.github.webhook_secret)))
+        metrics_runner = await start_metrics_server() if METRICS_PORT else None
+
+        # Replaces the handlers of the runner so queued events can be finished first
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        loop.add_signal_handler(signal.SIGHUP, reload_config)
+
+        site = await start_tcp_site(config.server, runner)
+        try:
+            await stopping.wait()
+        finally:
+            logger.info('Stopping the server')
+            await site.stop()
+            if CONFIG_RELOAD_INTERVAL > 0:
+                config_watcher.cancel()
+            if RECONCILE_INTERVAL > 0:
+                reconciler.cancel()
+            await JOB_SCHEDULER.drain(SHUTDOWN_TIMEOUT)
+            await flush_updates()
+            await close_exporters()
+            await runner.cleanup()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m prprocessor')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('serve', help='Process webhook events, the default')
+    revalidate_parser = subparsers.add_parser(
+        'revalidate', help='Check all open PRs again',
+        description='Check all open PRs again and update their check runs and Redmine issues, '
+                    'for example after Redmine was unavailable or the configuration changed.')
+    revalidate_parser.add_argument('repositories', nargs='*', metavar='REPOSITORY',
+                                   help='Only check these repositories, defaults to all '
+                                        'configured repositories')
+    revalidate_parser.add_argument('--concurrency', type=int, default=16,
+                                   help='Number of PRs to check at the same time (default: 16)')
+    revalidate_parser.add_argument('--progress', metavar='FILE',
+                                   help='Record checked PRs in this file and skip those that '
+                                        'were already checked at the same commit')
+    revalidate_parser.add_argument('--dry-run', action='store_true',
+                                   help="Report which check runs would change but don't change "
+                                        "anything")
+    return parser.parse_args()
 
 
 def run_prprocessor_app() -> None:
-    run_app(
-        name='prprocessor',
-        version='0.1.0',
-        url='https://github.com/apps/prprocessor',
+    args = parse_args()
+    config = BotAppConfig.from_dotenv(
+        app_name='prprocessor',
+        app_version='0.1.0',
+        app_url='https://github.com/apps/prprocessor',
     )
+    logging.basicConfig(level=logging.DEBUG if config.runtime.debug else logging.INFO)
+    logger.debug(' App version: %s '.center(50, '='), config.github.app_version)
+    if args.command == 'revalidate':
+        repositories = args.repositories or sorted(CONFIG_STORE.snapshot.repositories)
+        success = asyncio.run(revalidate(config, repositories, args.concurrency, args.progress,
+                                         args.dry_run))
+        sys.exit(0 if success else 1)
+    else:
+        asyncio.run(serve(config))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class TTLCache(Generic[K, V]):
+    """
+    A small LRU cache where entries expire after a fixed time.
+
+    >>> now = 0
+    >>> cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now)
+    >>> cache.set('a', 1)
+    >>> cache.get('a')
+    1
+    >>> cache.get('b') is None
+    True
+    >>> (cache.hits, cache.misses)
+    (1, 1)
+    >>> now = 11
+    >>> cache.get('a') is None
+    True
+
+    When the cache is full, the least recently used entry is evicted.
+
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> _ = cache.get('a')
+    >>> cache.set('c', 3)
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    >>> cache.invalidate('a')
+    >>> sorted(cache.keys())
+    ['c']
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._pending: dict[K, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self._lookup(key) is not None
+
+    def keys(self) -> list[K]:
+        return [key for key in list(self._data) if self._lookup(key) is not None]
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _lookup(self, key: K) -> Optional[tuple[float, V]]:
+        try:
+            entry = self._data[key]
+        except KeyError:
+            return None
+
+        if entry[0] <= self._clock():
+            del self._data[key]
+            return None
+
+        return entry
+
+    def peek(self, key: K) -> Optional[V]:
+        """
+        Look up a value without counting it as a hit or miss
+        """
+        entry = self._lookup(key)
+        return None if entry is None else entry[1]
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        expires = self._clock() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    async def get_or_load(self, key: K, loader: Callable[[], Awaitable[V]]) -> V:
+        """
+        Return the cached value or load it. Concurrent loads of the same key are shared so a
+        burst of events only results in a single request.
+        """
+        entry = self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry[1]
+
+        self.misses += 1
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Retrieve it so asyncio doesn't complain when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._pending[key]
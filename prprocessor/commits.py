@@ -0,0 +1,79 @@
+import os
+import re
+from typing import Optional
+
+from prprocessor.cache import TTLCache
+
+COMMIT_VALID_SUMMARY_REGEX = re.compile(
+    r'\A(?P<action>fixes|refs) (?P<issues>#\d+(?:, ?#\d+)*)(?::| -) .*\Z',
+    re.IGNORECASE,
+)
+
+# Commits can't change, so they never expire
+COMMIT_CACHE: TTLCache[str, 'Commit'] = TTLCache(
+    maxsize=int(os.environ.get('COMMIT_CACHE_SIZE', '4096')),
+    ttl=float('inf'),
+)
+
+
+class Commit:
+    """
+    The parts of a commit that are relevant for checking it. Instances are shared through the
+    cache so they should be treated as immutable.
+    """
+    __slots__ = ('sha', 'subject', 'fixes', 'refs')
+
+    def __init__(self, sha: str, subject: str, fixes: frozenset[int] = frozenset(),
+                 refs: frozenset[int] = frozenset()):
+        self.sha = sha
+        self.subject = subject
+        self.fixes = fixes
+        self.refs = refs
+
+    def __repr__(self) -> str:
+        return (f'Commit(sha={self.sha!r}, subject={self.subject!r}, fixes={set(self.fixes)}, '
+                f'refs={set(self.refs)})')
+
+
+def get_subject(message: str) -> str:
+    """
+    Return the first line without splitting the whole message
+
+    >>> get_subject('Fixes #1 - subject\\r\\n\\nLong description')
+    'Fixes #1 - subject'
+    >>> get_subject('')
+    ''
+    """
+    end = message.find('\n')
+    subject = message if end == -1 else message[:end]
+    return subject[:-1] if subject.endswith('\r') else subject
+
+
+def parse_commit(sha: str, message: str) -> Commit:
+    """
+    Parse the commit, using the cached result when the commit was seen before
+
+    >>> parse_commit('a1', 'Fixes #1, #2: subject\\n\\nRefs #3')
+    Commit(sha='a1', subject='Fixes #1, #2: subject', fixes={1, 2}, refs=set())
+    >>> parse_commit('a2', 'refs #3,#4 - subject')
+    Commit(sha='a2', subject='refs #3,#4 - subject', fixes=set(), refs={3, 4})
+    >>> parse_commit('a3', 'Fixes #1 without a separator').fixes
+    frozenset()
+    """
+    commit: Optional[Commit] = COMMIT_CACHE.get(sha)
+    if commit is None:
+        subject = get_subject(message)
+        commit = Commit(sha, subject)
+
+        match = COMMIT_VALID_SUMMARY_REGEX.match(subject)
+        if match:
+            issues = frozenset(int(issue.strip().lstrip('#'))
+                               for issue in match.group('issues').split(','))
+            if match.group('action').lower() == 'fixes':
+                commit.fixes = issues
+            else:
+                commit.refs = issues
+
+        COMMIT_CACHE.set(sha, commit)
+
+    return commit
@@ -0,0 +1,167 @@
+import asyncio
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, Mapping, Optional
+
+import yaml
+from pkg_resources import resource_filename
+
+WHITELISTED_ORGANIZATIONS = ('theforeman', 'Katello')
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class UnconfiguredRepository(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Config:
+    project: Optional[str] = None
+    required: bool = False
+    refs: frozenset = field(default_factory=frozenset)
+    version_prefix: Optional[str] = None
+    apply_labels: bool = True
+
+
+def config_digest(config: Config) -> str:
+    data = json.dumps(dataclasses.asdict(config), sort_keys=True, default=sorted)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+# Whitelisted organizations share the same config for all their unconfigured repositories
+FALLBACK_CONFIG = Config(apply_labels=False)
+FALLBACK_DIGEST = config_digest(FALLBACK_CONFIG)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    An immutable view of the configuration files. The version changes whenever their content
+    changes.
+
+    >>> snapshot = Snapshot.parse({'theforeman/foreman': {'redmine': 'foreman'}}, {'user': '1'})
+    >>> snapshot.get_config('theforeman/foreman').project
+    'foreman'
+    >>> snapshot.get_config('theforeman/unknown') is FALLBACK_CONFIG
+    True
+    >>> snapshot.get_config('someone/else')  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+        ...
+    UnconfiguredRepository: The repository someone/else is unconfigured
+    """
+    version: str
+    repositories: Mapping[str, Config]
+    digests: Mapping[str, str]
+    users: Mapping[str, str]
+
+    @classmethod
+    def parse(cls, repositories: Mapping, users: Mapping) -> 'Snapshot':
+        configs = {
+            repo: Config(project=config.get('redmine'),
+                         required=config.get('redmine_required', False),
+                         refs=frozenset(config.get('refs', [])),
+                         version_prefix=config.get('redmine_version_prefix'))
+            for repo, config in repositories.items()
+        }
+        digests = {repo: config_digest(config) for repo, config in configs.items()}
+        version = hashlib.sha1(json.dumps([sorted(digests.items()), sorted(users.items())])
+                               .encode()).hexdigest()[:12]
+        return cls(version=version, repositories=MappingProxyType(configs),
+                   digests=MappingProxyType(digests), users=MappingProxyType(dict(users)))
+
+    def get_config(self, repository: str) -> Config:
+        try:
+            return self.repositories[repository]
+        except KeyError:
+            user, _ = repository.split('/', 1)
+            if user not in WHITELISTED_ORGANIZATIONS:
+                logger.info('The repository %s is unconfigured and user %s not whitelisted',
+                            repository, user)
+                raise UnconfiguredRepository(f'The repository {repository} is unconfigured') \
+                    from None
+            return FALLBACK_CONFIG
+
+    def get_digest(self, repository: str) -> str:
+        """
+        A digest of the config that applies to the repository, which can be used in cache keys
+        """
+        try:
+            return self.digests[repository]
+        except KeyError:
+            return FALLBACK_DIGEST
+
+
+def load_snapshot(repos_path: str, users_path: str) -> Snapshot:
+    with open(repos_path) as repos_fp:
+        repositories = yaml.safe_load(repos_fp) or {}
+    with open(users_path) as users_fp:
+        users = yaml.safe_load(users_fp) or {}
+    return Snapshot.parse(repositories, users)
+
+
+class ConfigStore:
+    """
+    Holds the current snapshot of the configuration files and reloads it when they change.
+
+    A reload replaces the snapshot as a whole, so an event either sees the old or the new
+    configuration. When the changed files can't be loaded, the current snapshot is kept.
+    """
+
+    def __init__(self, repos_path: str, users_path: str):
+        self.repos_path = repos_path
+        self.users_path = users_path
+        self._mtimes = self._get_mtimes()
+        self.snapshot = load_snapshot(repos_path, users_path)
+
+    @property
+    def version(self) -> str:
+        return self.snapshot.version
+
+    def _get_mtimes(self) -> tuple[float, float]:
+        return (os.stat(self.repos_path).st_mtime, os.stat(self.users_path).st_mtime)
+
+    def reload(self) -> bool:
+        """
+        Load the files again if they were modified and return whether the config changed
+        """
+        try:
+            mtimes = self._get_mtimes()
+            if mtimes == self._mtimes:
+                return False
+            # Also on failure, so a broken file is only reported once
+            self._mtimes = mtimes
+            snapshot = load_snapshot(self.repos_path, self.users_path)
+        except (OSError, yaml.YAMLError, AttributeError, TypeError):
+            logger.exception('Failed to reload the configuration, keeping version %s',
+                             self.version)
+            return False
+
+        if snapshot.version == self.version:
+            return False
+
+        logger.info('Reloaded the configuration, version %s replaces %s', snapshot.version,
+                    self.version)
+        self.snapshot = snapshot
+        return True
+
+    async def watch(self, interval: float, on_change: Optional[Callable[[], None]] = None) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if self.reload() and on_change is not None:
+                on_change()
+
+
+CONFIG_STORE = ConfigStore(
+    os.environ.get('REPOS_CONFIG') or resource_filename(__name__, 'config/repos.yaml'),
+    os.environ.get('USERS_CONFIG') or resource_filename(__name__, 'config/users.yaml'),
+)
+
+
+def get_config(repository: str) -> Config:
+    return CONFIG_STORE.snapshot.get_config(repository)
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections.abc import MutableMapping
+from typing import Any, Iterator, Optional
+
+from prprocessor.cache import TTLCache
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# What gidgethub caches for a URL: the ETag, the Last-Modified date, the decoded body and the URL
+# of the next page
+Response = tuple[Optional[str], Optional[str], Any, Optional[str]]
+
+
+class DiskStore:
+    """
+    Responses stored in SQLite so they survive restarts. When it holds more than maxsize
+    responses, the least recently used are removed.
+
+    >>> store = DiskStore(':memory:', maxsize=2, prune_interval=1)
+    >>> store.set('/a', ('"1"', None, {'number': 1}, None))
+    >>> store.get('/a')
+    ('"1"', None, {'number': 1}, None)
+    >>> store.get('/b') is None
+    True
+    >>> store.set('/b', ('"2"', None, [], '/b?page=2'))
+    >>> _ = store.get('/a')
+    >>> store.set('/c', ('"3"', None, [], None))
+    >>> store.get('/b') is None
+    True
+    >>> len(store)
+    2
+    """
+
+    def __init__(self, path: str, maxsize: int, prune_interval: int = 100):
+        self.path = path
+        self.maxsize = maxsize
+        self.prune_interval = prune_interval
+        self._writes = 0
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Losing the last responses on a crash only costs a full response later
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            ''')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def __len__(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, url: str) -> Optional[Response]:
+        connection = self._connect()
+        row = connection.execute('SELECT data FROM responses WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+
+        with connection:
+            connection.execute('UPDATE responses SET accessed = ? WHERE url = ?',
+                               (time.time(), url))
+        etag, last_modified, data, more = json.loads(row[0])
+        return etag, last_modified, data, more
+
+    def set(self, url: str, response: Response) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO responses (url, data, accessed) '
+                               'VALUES (?, ?, ?)', (url, json.dumps(response), time.time()))
+
+        self._writes += 1
+        if self._writes % self.prune_interval == 0:
+            self.prune()
+
+    def delete(self, url: str) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM responses WHERE url = ?', (url,))
+
+    def clear(self) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM responses')
+
+    def prune(self) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM responses WHERE url NOT IN '
+                               '(SELECT url FROM responses ORDER BY accessed DESC LIMIT ?)',
+                               (self.maxsize,))
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class ResponseCache(MutableMapping):
+    """
+    A cache for gidgethub, which uses it to make conditional requests. A response GitHub reports
+    as not modified is served from the cache, and doesn't count against the rate limit.
+
+    The most recently used responses are kept in memory. Responses that don't fit are still
+    available from the disk store, if there is one.
+
+    >>> cache = ResponseCache(maxsize=1, disk=DiskStore(':memory:', maxsize=10))
+    >>> cache['/a'] = ('"1"', None, {'number': 1}, None)
+    >>> cache['/b'] = ('"2"', None, {'number': 2}, None)
+    >>> list(cache)
+    ['/b']
+    >>> cache['/a']
+    ('"1"', None, {'number': 1}, None)
+    >>> del cache['/a']
+    >>> '/a' in cache
+    False
+    """
+
+    def __init__(self, maxsize: int, disk: Optional[DiskStore] = None):
+        self.memory: TTLCache[str, Response] = TTLCache(maxsize=maxsize, ttl=float('inf'))
+        self.disk = disk
+
+    def _disk_call(self, method: str, *args: Any) -> Any:
+        if self.disk is None:
+            return None
+
+        try:
+            return getattr(self.disk, method)(*args)
+        except (sqlite3.Error, ValueError):
+            # Without the disk store fewer requests are conditional, but they still work
+            logger.exception('Failed to access the response cache %s', self.disk.path)
+            return None
+
+    def __getitem__(self, url: str) -> Response:
+        response = self.memory.get(url)
+        if response is None:
+            response = self._disk_call('get', url)
+            if response is None:
+                raise KeyError(url)
+            self.memory.set(url, response)
+        return response
+
+    def __setitem__(self, url: str, response: Response) -> None:
+        self.memory.set(url, response)
+        self._disk_call('set', url, response)
+
+    def __delitem__(self, url: str) -> None:
+        self.memory.invalidate(url)
+        self._disk_call('delete', url)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.memory.keys())
+
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self._disk_call('clear')
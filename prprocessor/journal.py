@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def get_default_path() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'prprocessor', 'journal.sqlite')
+
+
+@dataclass(frozen=True)
+class Entry:
+    id: int  # pylint: disable=invalid-name
+    key: int
+    data: dict[str, Any]
+    attempts: int
+
+
+class Journal:
+    """
+    An append-only list of pending work that survives restarts.
+
+    Entries are added before the work is started and removed once it's done, so anything left
+    in the journal when the process starts was interrupted.
+
+    >>> journal = Journal(':memory:')
+    >>> journal.append([(1, {'action': 'a'}), (2, {'action': 'b'})])
+    [1, 2]
+    >>> journal.failed([2])
+    >>> journal.remove([1])
+    >>> journal.pending()
+    [Entry(id=2, key=2, data={'action': 'b'}, attempts=1)]
+    >>> len(journal)
+    1
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # In WAL mode this is still safe against application crashes
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def __len__(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def append(self, entries: Iterable[tuple[int, dict[str, Any]]]) -> list[int]:
+        connection = self._connect()
+        now = time.time()
+        with connection:
+            return [connection.execute('INSERT INTO entries (key, data, created) VALUES (?, ?, ?)',
+                                       (key, json.dumps(data), now)).lastrowid
+                    for key, data in entries]
+
+    def remove(self, ids: Iterable[int]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.executemany('DELETE FROM entries WHERE id = ?', ((id_,) for id_ in ids))
+
+    def failed(self, ids: Iterable[int]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.executemany('UPDATE entries SET attempts = attempts + 1 WHERE id = ?',
+                                   ((id_,) for id_ in ids))
+
+    def pending(self) -> list[Entry]:
+        cursor = self._connect().execute('SELECT id, key, data, attempts FROM entries ORDER BY id')
+        return [Entry(id_, key, json.loads(data), attempts)
+                for id_, key, data, attempts in cursor]
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,300 @@
+import bisect
+import contextvars
+import math
+import os
+import time
+from collections import Counter as RequestCounter
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Generator, Iterable, Optional, TypeVar
+
+from aiohttp import web
+
+# The metrics are served on their own port so they aren't exposed along with the webhook
+# endpoint. They're only served if a port is set.
+METRICS_HOST = os.environ.get('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+METRICS_PATH = os.environ.get('METRICS_PATH', '/metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+M = TypeVar('M', bound='Metric')
+
+Labels = tuple[str, ...]
+# The suffix of the metric name, the label names and values, and the value
+Sample = tuple[str, tuple[tuple[str, str], ...], float]
+
+
+def format_value(value: float) -> str:
+    """
+    >>> format_value(3.0), format_value(0.25), format_value(float('inf'))
+    ('3', '0.25', '+Inf')
+    """
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels: Iterable[tuple[str, str]]) -> str:
+    """
+    >>> print(format_labels([('upstream', 'GitHub'), ('error', 'say "hi"')]))
+    {upstream="GitHub",error="say \\"hi\\""}
+    >>> format_labels([])
+    ''
+    """
+    escaped = [(name, value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+               for name, value in labels]
+    if not escaped:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Labels = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError()
+
+    def render(self) -> Generator[str, None, None]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for suffix, labels, value in self.samples():
+            yield f'{self.name}{suffix}{format_labels(labels)} {format_value(value)}'
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Counter(Metric):
+    """
+    A value that only goes up
+
+    >>> counter = Counter('requests_total', 'Requests made', ('upstream',))
+    >>> counter.labels('GitHub').inc()
+    >>> counter.labels('GitHub').inc(2)
+    >>> print('\\n'.join(counter.render()))
+    # HELP requests_total Requests made
+    # TYPE requests_total counter
+    requests_total{upstream="GitHub"} 3
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Labels = ()):
+        super().__init__(name, documentation, labels)
+        self._children: dict[Labels, _CounterChild] = {}
+
+    def labels(self, *values: str) -> _CounterChild:
+        try:
+            return self._children[values]
+        except KeyError:
+            child = self._children[values] = _CounterChild()
+            return child
+
+    def samples(self) -> Iterable[Sample]:
+        for values, child in sorted(self._children.items()):
+            yield '', tuple(zip(self.label_names, values)), child.value
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # The last one counts the values above the highest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self) -> Generator[None, None, None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(Metric):
+    """
+    Counts observations in cumulative buckets, like request durations
+
+    >>> histogram = Histogram('duration_seconds', 'Time taken', buckets=(0.1, 1))
+    >>> for value in (0.05, 0.5, 5):
+    ...     histogram.labels().observe(value)
+    >>> print('\\n'.join(histogram.render()))
+    # HELP duration_seconds Time taken
+    # TYPE duration_seconds histogram
+    duration_seconds_bucket{le="0.1"} 1
+    duration_seconds_bucket{le="1"} 2
+    duration_seconds_bucket{le="+Inf"} 3
+    duration_seconds_sum 5.55
+    duration_seconds_count 3
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Labels = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._children: dict[Labels, _HistogramChild] = {}
+
+    def labels(self, *values: str) -> _HistogramChild:
+        try:
+            return self._children[values]
+        except KeyError:
+            child = self._children[values] = _HistogramChild(self.buckets)
+            return child
+
+    def samples(self) -> Iterable[Sample]:
+        bounds = [format_value(bucket) for bucket in self.buckets] + ['+Inf']
+        for values, child in sorted(self._children.items()):
+            labels = tuple(zip(self.label_names, values))
+            total = 0
+            for bound, count in zip(bounds, child.counts):
+                total += count
+                yield '_bucket', labels + (('le', bound),), total
+            yield '_sum', labels, child.sum
+            yield '_count', labels, total
+
+
+class Collector(Metric):
+    """
+    Reads its samples when the metrics are exported, for values that are already tracked
+    elsewhere like queue lengths and cache statistics
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, labels: Labels,
+                 collect: Callable[[], Iterable[tuple[Labels, float]]]):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self._collect = collect
+
+    def samples(self) -> Iterable[Sample]:
+        for values, value in self._collect():
+            yield '', tuple(zip(self.label_names, values)), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Labels = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Labels = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def collector(self, name: str, documentation: str, kind: str, labels: Labels,
+                  collect: Callable[[], Iterable[tuple[Labels, float]]]) -> Collector:
+        return self.register(Collector(name, documentation, kind, labels, collect))
+
+    def render(self) -> str:
+        """
+        The metrics in the Prometheus text format
+        """
+        return ''.join(f'{line}\n' for metric in self._metrics.values()
+                       for line in metric.render())
+
+
+REGISTRY = Registry()
+
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    'prprocessor_upstream_requests_total',
+    'Requests made to GitHub and Redmine by outcome, which is ok or the name of the error',
+    ('upstream', 'outcome'),
+)
+UPSTREAM_DURATION = REGISTRY.histogram(
+    'prprocessor_upstream_request_duration_seconds',
+    'Time until GitHub or Redmine responded, excluding rate limiting',
+    ('upstream',),
+)
+EVENT_DURATION = REGISTRY.histogram(
+    'prprocessor_event_duration_seconds',
+    'Time spent processing an event by handler and outcome, excluding the time it was queued',
+    ('handler', 'outcome'),
+)
+EVENT_REQUESTS = REGISTRY.histogram(
+    'prprocessor_event_upstream_requests',
+    'Requests made to GitHub or Redmine while processing a single event',
+    ('handler', 'upstream'),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+STAGE_DURATION = REGISTRY.histogram(
+    'prprocessor_stage_duration_seconds',
+    'Time spent in each stage of checking or merging a PR',
+    ('operation', 'stage'),
+)
+
+# Requests per upstream made on behalf of the event that is being processed
+_event_requests: contextvars.ContextVar[Optional[RequestCounter]] = \
+    contextvars.ContextVar('event_requests', default=None)
+
+
+def record_request(upstream: str, outcome: str, duration: float) -> None:
+    UPSTREAM_REQUESTS.labels(upstream, outcome).inc()
+    UPSTREAM_DURATION.labels(upstream).observe(duration)
+    requests = _event_requests.get()
+    if requests is not None:
+        requests[upstream] += 1
+
+
+async def record_event(handler: str, factory: Callable[[], Awaitable[None]],
+                       upstreams: Iterable[str] = ('GitHub', 'Redmine')) -> None:
+    """
+    Process an event while recording how long it took and how many requests it made. Requests
+    made by tasks the event starts are included.
+    """
+    requests: RequestCounter = RequestCounter()
+    token = _event_requests.set(requests)
+    outcome = 'error'
+    start = time.perf_counter()
+    try:
+        await factory()
+        outcome = 'ok'
+    finally:
+        EVENT_DURATION.labels(handler, outcome).observe(time.perf_counter() - start)
+        _event_requests.reset(token)
+        for upstream in upstreams:
+            EVENT_REQUESTS.labels(handler, upstream).observe(requests[upstream])
+
+
+async def handle_metrics(_request: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT,
+                               path: str = METRICS_PATH) -> web.AppRunner:
+    """
+    Serve the metrics on the path of a separate server, which must be cleaned up when done
+    """
+    app = web.Application()
+    app.router.add_get(path, handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
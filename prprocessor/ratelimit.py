@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import random
+import time
+from enum import IntEnum
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from prprocessor.metrics import record_request
+
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class Priority(IntEnum):
+    # Lower values go first
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+def backoff(attempt: int, base: float = 1, cap: float = 60,
+            rand: Callable[[], float] = random.random) -> float:
+    """
+    Exponential backoff where a random half of the delay is dropped, so clients that failed at
+    the same time don't retry at the same time.
+
+    >>> [backoff(attempt, rand=lambda: 0) for attempt in range(1, 5)]
+    [0.5, 1.0, 2.0, 4.0]
+    >>> backoff(10, rand=lambda: 1)
+    60.0
+    """
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + delay / 2 * rand()
+
+
+def throttled_rate(max_rate: float, remaining: int, seconds_to_reset: float,
+                   low_water: int) -> float:
+    """
+    Spread the remaining quota until the reset once it's running low.
+
+    >>> throttled_rate(10, remaining=4000, seconds_to_reset=600, low_water=500)
+    10
+    >>> throttled_rate(10, remaining=300, seconds_to_reset=600, low_water=500)
+    0.5
+    """
+    if remaining > low_water:
+        return max_rate
+    return min(max_rate, remaining / max(seconds_to_reset, 1))
+
+
+class RateLimiter:
+    """
+    A token bucket shared by all calls to a single service.
+
+    Waiting callers with a higher priority go first. The rate is lowered when the service
+    reports its quota is running low and all calls are paused when it asks to retry later.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, low_water: int = 500,
+                 retry_after: Callable[[Exception], Optional[float]] = lambda exc: None,
+                 retries: int = 3):
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.low_water = low_water
+        self.retries = retries
+        self.throttled = 0
+        self._retry_after = retry_after
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = {priority: 0 for priority in Priority}
+
+    @property
+    def waiting(self) -> int:
+        return sum(self._waiting.values())
+
+    def update(self, remaining: Optional[int], reset: Optional[float]) -> None:
+        """
+        Adapt to the quota the service reported. The reset is a UNIX timestamp.
+        """
+        if remaining is None or reset is None:
+            return
+
+        seconds_to_reset = reset - time.time()
+        if remaining <= 0:
+            self.pause(seconds_to_reset)
+        self.rate = max(throttled_rate(self.max_rate, remaining, seconds_to_reset,
+                                       self.low_water), 0.01)
+
+    def pause(self, seconds: float) -> None:
+        if seconds > 0:
+            logger.warning('Pausing %s requests for %.1f seconds', self.name, seconds)
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _delay(self, priority: Priority) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        if self._paused_until > now:
+            return self._paused_until - now
+        if any(self._waiting[other] for other in Priority if other < priority):
+            return 1 / self.rate
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self, priority: Priority = Priority.NORMAL) -> None:
+        delay = self._delay(priority)
+        if delay <= 0:
+            self._tokens -= 1
+            return
+
+        self.throttled += 1
+        self._waiting[priority] += 1
+        try:
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = self._delay(priority)
+            self._tokens -= 1
+        finally:
+            self._waiting[priority] -= 1
+
+    async def call(self, factory: Callable[[], Awaitable[T]],
+                   priority: Priority = Priority.NORMAL) -> T:
+        """
+        Make a call when the limit allows it. When the service responds it's being rate limited,
+        the call is retried with backoff. Every attempt is recorded in the metrics.
+        """
+        attempt = 1
+        while True:
+            await self.acquire(priority)
+            start = time.perf_counter()
+            try:
+                result = await factory()
+            except Exception as exc:  # pylint: disable=broad-except
+                record_request(self.name, type(exc).__name__, time.perf_counter() - start)
+                retry_after = self._retry_after(exc)
+                if retry_after is None or attempt > self.retries:
+                    raise
+                self.pause(max(retry_after, backoff(attempt)))
+                attempt += 1
+            else:
+                record_request(self.name, 'ok', time.perf_counter() - start)
+                return result
@@ -1,17 +1,76 @@
+import asyncio
 import logging
 import os
-from dataclasses import dataclass
-from enum import IntEnum, unique
-from distutils.version import LooseVersion  # pylint: disable=no-name-in-module,import-error
-from typing import AbstractSet, Generator, Iterable, Optional
+import re
+import sqlite3
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from enum import Enum, IntEnum, unique
+from functools import lru_cache, partial
+from typing import (AbstractSet, Any, Awaitable, Callable, Generator, Iterable, Optional,
+                    TypeVar, Union)
 
 from redminelib import Redmine
-from redminelib.exceptions import ResourceNotFoundError
+from redminelib.engines.sync import SyncEngine
+from redminelib.exceptions import BaseRedmineError, ResourceNotFoundError, ServerError
 from redminelib.resources import CustomField, Issue, Project
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+from prprocessor.cache import TTLCache
+from prprocessor.journal import Entry, Journal, get_default_path
+from prprocessor.ratelimit import RateLimiter
+from prprocessor.retry import (CircuitBreaker, CircuitOpenError, RetryBudget, RetryPolicy,
+                               call_with_retry)
+from prprocessor.tracing import set_attributes, span, start_trace
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+T = TypeVar('T')
+
+# python-redmine is blocking, so all calls are made on a dedicated thread pool. Every worker
+# can hold its own keep-alive connection, which is why the pool is sized the same.
+REDMINE_WORKERS = int(os.environ.get('REDMINE_WORKERS', '10'))
+REDMINE_TIMEOUT = float(os.environ.get('REDMINE_TIMEOUT', '30'))
+# How many requests a single call may have in flight so one big PR can't starve the others
+REDMINE_FANOUT = int(os.environ.get('REDMINE_FANOUT', '4'))
+# Keep the issue_id filter well below common URL length limits
+MAX_FILTER_LENGTH = 1500
+
+_executor: Optional[ThreadPoolExecutor] = None  # pylint: disable=invalid-name
+_redmine: Optional[Redmine] = None  # pylint: disable=invalid-name
+
+# Projects are practically static, but versions are opened and closed on releases
+PROJECT_CACHE: TTLCache[str, Project] = TTLCache(
+    maxsize=int(os.environ.get('REDMINE_CACHE_SIZE', '256')),
+    ttl=float(os.environ.get('REDMINE_PROJECT_CACHE_TTL', '3600')),
+)
+VERSION_CACHE: TTLCache[int, 'VersionIndex'] = TTLCache(
+    maxsize=int(os.environ.get('REDMINE_CACHE_SIZE', '256')),
+    ttl=float(os.environ.get('REDMINE_VERSION_CACHE_TTL', '300')),
+)
+# The versions of a project as they were last fetched, which are kept after they expire so a
+# refresh only has to look at versions that changed
+_version_indexes: dict[int, 'VersionIndex'] = {}
+# GitHub tends to send several events for the same push in a short time
+ISSUE_CACHE: TTLCache[int, Issue] = TTLCache(
+    maxsize=int(os.environ.get('REDMINE_ISSUE_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('REDMINE_ISSUE_CACHE_TTL', '60')),
+)
+# Updates are recorded here until they're saved so they survive a restart. It can be disabled
+# by setting it to an empty value.
+REDMINE_JOURNAL = os.environ.get('REDMINE_JOURNAL', get_default_path())
+# Updates that keep failing, for example because the issue can no longer be edited, are dropped
+# rather than replayed on every start
+REDMINE_JOURNAL_MAX_ATTEMPTS = int(os.environ.get('REDMINE_JOURNAL_MAX_ATTEMPTS', '5'))
+_journal: Optional[Journal] = None  # pylint: disable=invalid-name
+
+# Cached issues are shared between events so writes to the same issue must not interleave
+_issue_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+
 
 # These hardcoded IDs are not pretty, but it works for now
 @unique
@@ -42,6 +101,33 @@ class Status(IntEnum):
         return self.value in (Status.REJECTED, Status.DUPLICATE)
 
 
+@unique
+class Action(Enum):
+    LINK_PULL_REQUEST = 'link_pull_request'
+    UNLINK_PULL_REQUEST = 'unlink_pull_request'
+    SET_FIXED_IN_VERSION = 'set_fixed_in_version'
+
+
+@dataclass(frozen=True)
+class Mutation:
+    """
+    An intended change to an issue. The actual updates are determined from the current state
+    of the issue, so applying a mutation twice has no effect.
+    """
+    issue_id: int
+    action: Action
+    pull_request: Optional[str] = None
+    assignee: Optional[int] = None
+    version_id: Optional[int] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return dict(asdict(self), action=self.action.value)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'Mutation':
+        return cls(**dict(data, action=Action(data['action'])))
+
+
 @dataclass
 class IssueValidation:
     project: Optional[Project]
@@ -50,29 +136,381 @@ class IssueValidation:
     missing_issue_ids: AbstractSet[int]
 
 
+class RateLimitedError(BaseRedmineError):
+    def __init__(self, retry_after: float):
+        super().__init__(f'Rate limited, retry after {retry_after} seconds')
+        self.retry_after = retry_after
+
+
+class UnavailableError(ServerError):
+    def __init__(self, status_code: int):  # pylint: disable=super-init-not-called
+        BaseRedmineError.__init__(self, f'Redmine is unavailable (HTTP {status_code})')
+        self.status_code = status_code
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    return exc.retry_after if isinstance(exc, RateLimitedError) else None
+
+
+def _parse_number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# Redmine itself doesn't limit, but a proxy in front of it may
+REDMINE_LIMITER = RateLimiter('Redmine', rate=float(os.environ.get('REDMINE_RATE', '20')),
+                              burst=int(os.environ.get('REDMINE_BURST', '20')),
+                              retry_after=_retry_after)
+
+# Only errors where Redmine or the connection to it failed are retried. Anything else, like a
+# missing issue, would only fail again.
+REDMINE_RETRY = RetryPolicy(retry_on=(ServerError, RequestsConnectionError, Timeout),
+                            attempts=int(os.environ.get('REDMINE_RETRIES', '3')),
+                            deadline=float(os.environ.get('REDMINE_RETRY_DEADLINE', '60')))
+REDMINE_RETRY_BUDGET = RetryBudget('Redmine')
+REDMINE_BREAKER = CircuitBreaker(
+    'Redmine',
+    threshold=int(os.environ.get('REDMINE_BREAKER_THRESHOLD', '5')),
+    reset_timeout=float(os.environ.get('REDMINE_BREAKER_TIMEOUT', '30')),
+)
+
+
+@dataclass
+class PoolStats:
+    requests: int
+    connections: int
+    in_flight: int
+    idle: int
+    max_size: int
+
+    @property
+    def reused(self) -> int:
+        return max(self.requests - self.connections, 0)
+
+
+class PooledEngine(SyncEngine):
+    """
+    An engine with a keep-alive connection pool that can be shared by all workers
+    """
+
+    def __init__(self, **options):
+        self._lock = threading.Lock()
+        self._request_count = 0
+        self._in_flight = 0
+        super().__init__(**options)
+
+    @staticmethod
+    def create_session(**params):
+        session = SyncEngine.create_session(**params)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=REDMINE_WORKERS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        kwargs = self.construct_request_kwargs(method, headers, params, data)
+        with self._lock:
+            self._request_count += 1
+            self._in_flight += 1
+        try:
+            response = self.session.request(method, url, timeout=REDMINE_TIMEOUT, **kwargs)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        remaining = _parse_number(response.headers.get('X-RateLimit-Remaining'))
+        reset = _parse_number(response.headers.get('X-RateLimit-Reset'))
+        if remaining is not None:
+            REDMINE_LIMITER.update(int(remaining), reset)
+
+        if response.status_code in (429, 503):
+            retry_after = _parse_number(response.headers.get('Retry-After'))
+            if response.status_code == 429 or retry_after is not None:
+                raise RateLimitedError(retry_after or 0)
+
+        # Typically a proxy in front of Redmine that's unable to reach it
+        if response.status_code in (502, 503, 504):
+            raise UnavailableError(response.status_code)
+
+        return self.process_response(response)
+
+    def stats(self) -> PoolStats:
+        connections = 0
+        idle = 0
+        # The same adapter is mounted for both http:// and https://
+        pools = self.session.get_adapter('https://').poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+        with self._lock:
+            return PoolStats(requests=self._request_count, connections=connections,
+                             in_flight=self._in_flight, idle=idle, max_size=REDMINE_WORKERS)
+
+
 def get_redmine() -> Redmine:
-    # Handle the KeyError
-    url = os.environ['REDMINE_URL']
-    key = os.environ.get('REDMINE_KEY')
-    return Redmine(url, key=key)
+    """
+    Return the process wide Redmine client so connections are reused between events
+    """
+    global _redmine  # pylint: disable=global-statement,invalid-name
+    if _redmine is None:
+        # Handle the KeyError
+        url = os.environ['REDMINE_URL']
+        key = os.environ.get('REDMINE_KEY')
+        _redmine = Redmine(url, key=key, engine=PooledEngine)
+    return _redmine
+
+
+def get_redmine_stats() -> Optional[PoolStats]:
+    if _redmine is None:
+        return None
+    return _redmine.engine.stats()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor  # pylint: disable=global-statement,invalid-name
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=REDMINE_WORKERS, thread_name_prefix='redmine')
+    return _executor
+
+
+async def run_sync(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking python-redmine call without blocking the event loop. Failed calls are
+    retried according to REDMINE_RETRY, and none are made while Redmine is unavailable.
+
+    Lazy resource sets must be materialized inside func, otherwise the actual request happens
+    when they're iterated in the caller.
+    """
+    loop = asyncio.get_running_loop()
+    call = partial(func, *args, **kwargs)
+    return await call_with_retry(
+        lambda: REDMINE_LIMITER.call(lambda: loop.run_in_executor(_get_executor(), call)),
+        REDMINE_RETRY, REDMINE_RETRY_BUDGET, REDMINE_BREAKER)
+
+
+def is_unavailable(exc: BaseException) -> bool:
+    """
+    Whether the error means Redmine couldn't be reached, as opposed to a problem with the request
+    """
+    return isinstance(exc, CircuitOpenError) or \
+        (isinstance(exc, Exception) and REDMINE_RETRY.is_retryable(exc))
+
+
+async def wait_until_available() -> None:
+    """
+    Wait until Redmine is available again. Redmine is probed when the breaker allows a trial
+    call, so recovery is noticed even if nothing else calls Redmine in the meantime.
+    """
+    while not REDMINE_BREAKER.available:
+        await asyncio.sleep(max(REDMINE_BREAKER.retry_in, 1))
+        redmine = get_redmine()
+        try:
+            await run_sync(lambda: list(redmine.issue_status.all()))
+        except Exception:  # pylint: disable=broad-except
+            # Any response at all closes the breaker again
+            logger.debug('Redmine is still unavailable', exc_info=True)
+
+
+async def get_project(redmine: Redmine, project_id: str) -> Project:
+    async def load() -> Project:
+        with span('redmine.project.get', project=project_id):
+            return await run_sync(redmine.project.get, project_id)
+
+    return await PROJECT_CACHE.get_or_load(project_id, load)
+
+
+async def get_project_ids(redmine: Redmine, project_ids: Iterable[str]) -> set[int]:
+    projects = await asyncio.gather(*(get_project(redmine, project_id)
+                                      for project_id in project_ids))
+    return {project.id for project in projects}
+
+
+async def get_open_versions(project: Project) -> 'VersionIndex':
+    async def load() -> VersionIndex:
+        with span('redmine.version.filter', project=project.id):
+            versions = await run_sync(lambda: list(project.versions.filter(status='open')))
+
+        # Redmine can't filter versions by when they were updated, so all of them are fetched
+        # again but the index is only updated where they changed
+        index = _version_indexes.get(project.id)
+        if index is None:
+            index = _version_indexes[project.id] = VersionIndex(versions)
+        else:
+            changed = index.refresh(versions)
+            logger.debug('%s of %s open versions of %s changed', changed, len(index),
+                         project.name)
+        return index
+
+    return await VERSION_CACHE.get_or_load(project.id, load)
+
+
+def invalidate_caches() -> None:
+    """
+    Drop all cached projects and versions
+    """
+    PROJECT_CACHE.clear()
+    VERSION_CACHE.clear()
+    _version_indexes.clear()
+
+
+def _cache_issue(issue: Issue) -> None:
+    cached = ISSUE_CACHE.peek(issue.id)
+    # The timestamps are in the same format so they can be compared as strings
+    if cached is None or cached.raw().get('updated_on', '') <= issue.raw().get('updated_on', ''):
+        ISSUE_CACHE.set(issue.id, issue)
+
+
+async def save_issue(issue: Issue, **updates: Any) -> None:
+    """
+    Save the issue and keep the cached resource in line with what was saved, so deciding on
+    updates again doesn't save the same values a second time.
+
+    >>> from redminelib.engines.base import BaseEngine
+    >>> class RecordingEngine(BaseEngine):
+    ...     sent = []
+    ...     @staticmethod
+    ...     def create_session(**params):
+    ...         return None
+    ...     def request(self, method, url, headers=None, params=None, data=None):
+    ...         self.sent.append((method, data))
+    ...         return True
+    >>> redmine = Redmine('https://redmine.example.com', engine=RecordingEngine)
+    >>> issue = redmine.issue.to_resource({'id': 1, 'status': {'id': 1, 'name': 'New'}})
+    >>> issue.status.id
+    1
+    >>> asyncio.run(save_issue(issue, status_id=7))
+    >>> issue.status.id
+    7
+    >>> RecordingEngine.sent
+    [('put', {'issue': {'status_id': 7}})]
+    """
+    lock = _issue_locks.setdefault(issue.id, asyncio.Lock())
+    async with lock:
+        try:
+            with span('redmine.issue.save', issue=issue.id):
+                await run_sync(issue.save, **updates)
+            # Setting status_id updates the raw status but python-redmine keeps returning the
+            # status it decoded before
+            for name in updates:
+                if name.endswith('_id'):
+                    issue._encoded_attrs.pop(name[:-3], None)  # pylint: disable=protected-access
+        except Exception:
+            # save() changes the resource before the request, so it no longer matches Redmine
+            if ISSUE_CACHE.peek(issue.id) is issue:
+                ISSUE_CACHE.invalidate(issue.id)
+            raise
+    # save() updates the resource and its updated_on in place so write it through
+    _cache_issue(issue)
+
+
+def chunk_issue_ids(issue_ids: Iterable[int], max_length: int = MAX_FILTER_LENGTH) \
+        -> Generator[str, None, None]:
+    """
+    Split issue IDs into comma separated filter values that are at most max_length long
+
+    >>> list(chunk_issue_ids({3, 1, 2}))
+    ['1,2,3']
+    >>> list(chunk_issue_ids([12345, 23456, 34567], max_length=11))
+    ['12345,23456', '34567']
+    >>> list(chunk_issue_ids([]))
+    []
+    """
+    chunk: list[str] = []
+    length = 0
+    for issue_id in sorted(issue_ids):
+        value = str(issue_id)
+        if chunk and length + 1 + len(value) > max_length:
+            yield ','.join(chunk)
+            chunk = []
+            length = 0
+        length += len(value) + (1 if chunk else 0)
+        chunk.append(value)
+
+    if chunk:
+        yield ','.join(chunk)
+
+
+async def gather_bounded(awaitables: Iterable[Awaitable[T]], limit: int = REDMINE_FANOUT,
+                         return_exceptions: bool = False) -> list[T]:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(awaitable: Awaitable[T]) -> T:
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(run(awaitable) for awaitable in awaitables),
+                                return_exceptions=return_exceptions)
+
+
+async def _get_issue_or_none(redmine: Redmine, issue_id: int) -> Optional[Issue]:
+    try:
+        with span('redmine.issue.get', issue=issue_id):
+            return await run_sync(redmine.issue.get, issue_id)
+    except ResourceNotFoundError:
+        return None
+
+
+async def _filter_issues(redmine: Redmine, issue_ids: str) -> list[Issue]:
+    with span('redmine.issue.filter', issues=issue_ids.count(',') + 1):
+        # By default only open issues are returned
+        return await run_sync(lambda: list(redmine.issue.filter(issue_id=issue_ids,
+                                                                status_id='*')))
+
+
+async def get_issues(redmine: Redmine, issue_ids: AbstractSet[int]) -> AbstractSet[Issue]:
+    with span('get_issues', issues=len(issue_ids)):
+        return await _get_issues(redmine, issue_ids)
+
 
+async def _get_issues(redmine: Redmine, issue_ids: AbstractSet[int]) -> AbstractSet[Issue]:
+    issues = {issue for issue in map(ISSUE_CACHE.get, issue_ids) if issue is not None}
+    uncached = issue_ids - {issue.id for issue in issues}
+    set_attributes(cached=len(issues))
+    if not uncached:
+        return issues
 
-def get_issues(redmine: Redmine, issue_ids: AbstractSet[int]) -> AbstractSet[Issue]:
     # You can search for a comma separated string and find multiple
-    issue_id = ','.join(map(str, sorted(issue_ids)))
-    issues = set(redmine.issue.filter(issue_id=issue_id))
+    results = await gather_bounded(_filter_issues(redmine, chunk)
+                                   for chunk in chunk_issue_ids(uncached))
+    fetched = {issue for result in results for issue in result}
 
     # But that search sometimes misses issues that do exist
-    for missing in issue_ids ^ {issue.id for issue in issues}:
-        try:
-            issues.add(redmine.issue.get(missing))
-        except ResourceNotFoundError:
-            pass
+    missing = uncached - {issue.id for issue in fetched}
+    if missing:
+        results = await gather_bounded(_get_issue_or_none(redmine, issue_id)
+                                       for issue_id in sorted(missing))
+        fetched.update(issue for issue in results if issue is not None)
+
+    for issue in fetched:
+        _cache_issue(issue)
+
+    return issues | fetched
+
+
+async def get_linked_issues(redmine: Redmine, offset: int, limit: int) -> tuple[list[Issue], int]:
+    """
+    Return a page of the issues that link to any PR, ordered by ID, and how many there are
+    """
+    def load() -> tuple[list[Issue], int]:
+        issues = redmine.issue.filter(status_id='*', sort='id', offset=offset, limit=limit,
+                                      **{f'cf_{Field.PULL_REQUEST.value}': '*'})
+        return list(issues), issues.total_count
 
-    return issues
+    with span('redmine.issue.filter', offset=offset, limit=limit):
+        issues, total = await run_sync(load)
 
+    for issue in issues:
+        _cache_issue(issue)
 
-def verify_issues(config, issue_ids: AbstractSet[int]) -> IssueValidation:
+    return issues, total
+
+
+async def verify_issues(config, issue_ids: AbstractSet[int]) -> IssueValidation:
     correct_project = None
     issues: AbstractSet[Issue] = set()
     invalid_issues: AbstractSet[Issue] = set()
@@ -80,14 +518,16 @@ def verify_issues(config, issue_ids: AbstractSet[int]) -> IssueValidation:
 
     if issue_ids:
         redmine = get_redmine()
-        issues = get_issues(redmine, issue_ids)
+        issues = await get_issues(redmine, issue_ids)
 
         if issues:
             missing_issue_ids -= {issue.id for issue in issues}
 
             if config.project:
-                correct_project = redmine.project.get(config.project)
-                refs = {redmine.project.get(ref).id for ref in config.refs}
+                correct_project, refs = await asyncio.gather(
+                    get_project(redmine, config.project),
+                    get_project_ids(redmine, config.refs),
+                )
                 project_ids = {correct_project.id} | refs
                 invalid_issues = {issue for issue in issues if issue.project.id not in project_ids}
 
@@ -98,32 +538,419 @@ def verify_issues(config, issue_ids: AbstractSet[int]) -> IssueValidation:
                            missing_issue_ids=missing_issue_ids)
 
 
-def set_fixed_in_version(issue: Issue, version: CustomField) -> None:
-    field = issue.custom_fields.get(Field.FIXED_IN_VERSIONS.value)
+def get_updates(issue: Issue, mutations: Iterable[Mutation]) -> dict[str, Any]:
+    """
+    Determine the updates to save for the issue to apply all mutations
+    """
+    updates: dict[str, Any] = {}
     # For some reason field values are strings
-    version_id = str(version.id)
-    if version_id not in field.value:
-        issue.save(custom_fields=[{'id': field.id, 'value': field.value + [version_id]}])
+    field_values: dict[int, list[str]] = {}
+    status = Status(issue.status.id)
 
+    def get_value(field: Field) -> list[str]:
+        if field.value not in field_values:
+            field_values[field.value] = list(issue.custom_fields.get(field.value).value)
+        return field_values[field.value]
 
-def get_latest_open_version(project: Project, version_prefix: str) \
-        -> Optional[CustomField]:
-    versions = _filter_versions(project.versions.filter(status='open'), version_prefix)
+    for mutation in mutations:
+        if mutation.action == Action.LINK_PULL_REQUEST:
+            if status.is_rejected():
+                continue
 
-    try:
-        return sorted(versions, key=lambda version: LooseVersion(version.name))[-1]
-    except ValueError:
-        logger.exception('Failed to parse version for %s: %s', project.name, versions)
+            # TODO: rewrite this
+            #if issue.backlog or issue.recycle_bin or not issue.fixed_version_id:
+            #    triaged_field = issue.custom_fields.get(Field.TRIAGED)
+            #    if triaged_field.value is True:  # TODO does the API return a boolean?
+            #        updates['custom_fields'] = [{'id': triaged_field.id, 'value': False}]
+
+            #    updates['fixed_version_id'] = None
+
+            if mutation.pull_request:
+                value = get_value(Field.PULL_REQUEST)
+                if mutation.pull_request not in value:
+                    value.append(mutation.pull_request)
+
+            if mutation.assignee and not hasattr(issue, 'assigned_to'):
+                updates.setdefault('assigned_to_id', mutation.assignee)
+
+            if not (status.is_closed() or status == Status.READY_FOR_TESTING):
+                status = Status.READY_FOR_TESTING
+                updates['status_id'] = status.value
+        elif mutation.action == Action.UNLINK_PULL_REQUEST:
+            value = get_value(Field.PULL_REQUEST)
+            if mutation.pull_request in value:
+                value.remove(mutation.pull_request)
+        elif mutation.action == Action.SET_FIXED_IN_VERSION:
+            value = get_value(Field.FIXED_IN_VERSIONS)
+            if str(mutation.version_id) not in value:
+                value.append(str(mutation.version_id))
+
+    changed_fields = [{'id': field_id, 'value': value}
+                      for field_id, value in field_values.items()
+                      if value != issue.custom_fields.get(field_id).value]
+    if changed_fields:
+        updates['custom_fields'] = changed_fields
+
+    return updates
+
+
+def get_journal() -> Optional[Journal]:
+    global _journal  # pylint: disable=global-statement,invalid-name
+    if _journal is None and REDMINE_JOURNAL:
+        _journal = Journal(REDMINE_JOURNAL)
+    return _journal
+
+
+def _journal_call(method: str, *args: Any) -> Any:
+    journal = get_journal()
+    if journal is None:
         return None
-    except IndexError:
-        logger.warning('No versions found for %s', project.name)
+
+    try:
+        return getattr(journal, method)(*args)
+    except (sqlite3.Error, OSError):
+        # Losing the durability is better than losing the update itself
+        logger.exception('Failed to access the journal %s', journal.path)
         return None
 
 
-def _filter_versions(versions: Iterable[CustomField],
-                     version_prefix: str) -> Generator[CustomField, None, None]:
-    for version in versions:
-        if version.name.startswith(version_prefix):
-            name = version.name.removeprefix(version_prefix)
-            if name and name[0].isdigit():
-                yield version
+@dataclass
+class _PendingWrite:
+    issue: Issue
+    mutations: list[Mutation]
+    journal_ids: list[int]
+    # The issue needs to be fetched again after a failed save
+    stale: bool = False
+
+
+class WriteBuffer:
+    """
+    Collects mutations per issue for a short time so multiple events that change the same issue
+    result in a single save. Saves are made concurrently, bounded by REDMINE_FANOUT.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.writes = 0
+        # Writes that were avoided by merging mutations
+        self.saved_writes = 0
+        self._pending: dict[int, _PendingWrite] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        # Flushes that are saving right now, which can't be cancelled halfway
+        self._saving: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, issue: Issue, mutations: list[Mutation], journal_ids: list[int]) -> None:
+        pending = self._pending.get(issue.id)
+        if pending is None:
+            self._pending[issue.id] = _PendingWrite(issue, list(mutations), list(journal_ids))
+        else:
+            # Prefer the most recently fetched version of the issue
+            pending.issue = issue
+            pending.mutations.extend(mutations)
+            pending.journal_ids.extend(journal_ids)
+
+        self._schedule()
+
+    def _requeue(self, write: _PendingWrite) -> None:
+        pending = self._pending.get(write.issue.id)
+        if pending is None:
+            pending = self._pending[write.issue.id] = write
+        else:
+            # Anything added in the meantime is newer
+            pending.mutations[:0] = write.mutations
+            pending.journal_ids[:0] = write.journal_ids
+        pending.stale = True
+
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.delay)
+        # Writes are kept while Redmine is unavailable rather than failing one by one
+        try:
+            await wait_until_available()
+        finally:
+            self._flush_task = None
+
+        task = asyncio.create_task(self._flush())
+        self._saving.add(task)
+        task.add_done_callback(self._saving.discard)
+        await asyncio.shield(task)
+
+    async def flush(self) -> None:
+        """
+        Save everything that's pending right away and wait for saves that already started
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush()
+        if self._saving:
+            await asyncio.wait(self._saving)
+
+    async def _flush(self) -> None:
+        pending, self._pending = list(self._pending.values()), {}
+        if not pending:
+            return
+
+        async def save(write: _PendingWrite) -> bool:
+            if write.stale:
+                with span('redmine.issue.get', issue=write.issue.id):
+                    write.issue = await run_sync(get_redmine().issue.get, write.issue.id)
+                _cache_issue(write.issue)
+
+            updates = get_updates(write.issue, write.mutations)
+            if not updates:
+                logger.debug('Redmine issue %s already in sync', write.issue.id)
+                return False
+
+            logger.info('Updating issue %s: %s', write.issue.id, updates)
+            await save_issue(write.issue, **updates)
+            return True
+
+        # Saves are shared by events, so they're traced by themselves
+        with start_trace('redmine.flush', issues=len(pending)):
+            results = await gather_bounded((save(write) for write in pending),
+                                           return_exceptions=True)
+
+        done: list[int] = []
+        failed: list[int] = []
+        requeued = 0
+        for write, result in zip(pending, results):
+            if isinstance(result, Exception) and is_unavailable(result):
+                logger.warning('Redmine is unavailable, keeping the update of issue %s: %s',
+                               write.issue.id, result)
+                self._requeue(write)
+                requeued += 1
+            elif isinstance(result, Exception):
+                logger.error('Failed to update issue %s', write.issue.id, exc_info=result)
+                failed.extend(write.journal_ids)
+            else:
+                self.writes += int(result)
+                self.saved_writes += len(write.mutations) - int(result)
+                done.extend(write.journal_ids)
+
+        if done:
+            _journal_call('remove', done)
+        if failed:
+            _journal_call('failed', failed)
+
+        logger.info('Saved %s Redmine issues, %s writes saved by merging so far',
+                    len(pending) - requeued, self.saved_writes)
+
+
+WRITE_BUFFER = WriteBuffer(delay=float(os.environ.get('REDMINE_WRITE_DELAY', '2')))
+
+
+async def update_issues(issues: Iterable[Issue], mutations: Iterable[Mutation]) -> None:
+    """
+    Apply mutations to the given issues. Mutations for issues that aren't given are ignored.
+
+    The mutations are recorded in the journal and then handed to the write buffer, which saves
+    them shortly after. replay_journal() finishes them after a crash.
+    """
+    mutations_by_issue: dict[int, list[Mutation]] = {}
+    for mutation in mutations:
+        mutations_by_issue.setdefault(mutation.issue_id, []).append(mutation)
+
+    pending = []
+    for issue in issues:
+        issue_mutations = mutations_by_issue.get(issue.id)
+        if not issue_mutations:
+            continue
+
+        if get_updates(issue, issue_mutations):
+            pending.append((issue, issue_mutations))
+        else:
+            logger.debug('Redmine issue %s already in sync', issue.id)
+
+    if not pending:
+        return
+
+    entry_ids = _journal_call('append', [(mutation.issue_id, mutation.to_dict())
+                                         for _, issue_mutations in pending
+                                         for mutation in issue_mutations])
+    ids = iter(entry_ids or [])
+    for issue, issue_mutations in pending:
+        WRITE_BUFFER.add(issue, issue_mutations,
+                         [next(ids) for _ in issue_mutations] if entry_ids else [])
+
+
+async def flush_updates() -> None:
+    await WRITE_BUFFER.flush()
+
+
+async def replay_journal(redmine: Redmine) -> None:
+    """
+    Apply mutations that were interrupted, for example by a restart. Mutations that failed
+    REDMINE_JOURNAL_MAX_ATTEMPTS times are dropped.
+    """
+    journal = get_journal()
+    if journal is None:
+        return
+
+    entries = _journal_call('pending')
+    if not entries:
+        return
+
+    expired = [entry for entry in entries if entry.attempts >= REDMINE_JOURNAL_MAX_ATTEMPTS]
+    if expired:
+        for entry in expired:
+            logger.error('Dropping update of issue %s after %s failed attempts: %s',
+                         entry.key, entry.attempts, entry.data)
+        _journal_call('remove', [entry.id for entry in expired])
+        entries = [entry for entry in entries if entry.attempts < REDMINE_JOURNAL_MAX_ATTEMPTS]
+        if not entries:
+            return
+
+    logger.info('Replaying %s pending Redmine updates', len(entries))
+    entries_by_issue: dict[int, list[Entry]] = {}
+    for entry in entries:
+        entries_by_issue.setdefault(entry.key, []).append(entry)
+
+    # The entries are handed over as they are so failures keep counting towards the limit
+    issues = await get_issues(redmine, set(entries_by_issue))
+    for issue in issues:
+        issue_entries = entries_by_issue.pop(issue.id)
+        WRITE_BUFFER.add(issue, [Mutation.from_dict(entry.data) for entry in issue_entries],
+                         [entry.id for entry in issue_entries])
+
+    if entries_by_issue:
+        logger.warning('Dropping updates of issues that no longer exist: %s',
+                       ', '.join(map(str, sorted(entries_by_issue))))
+        _journal_call('remove', [entry.id for issue_entries in entries_by_issue.values()
+                                 for entry in issue_entries])
+    await flush_updates()
+
+
+async def set_fixed_in_version(issue: Issue, version: CustomField) -> None:
+    await update_issues([issue], [Mutation(issue.id, Action.SET_FIXED_IN_VERSION,
+                                           version_id=version.id)])
+
+
+VERSION_COMPONENT_REGEX = re.compile(r'\d+|[a-zA-Z]+')
+
+VersionKey = tuple[tuple[int, Union[int, str]], ...]
+
+
+@lru_cache(maxsize=4096)
+def parse_version(name: str) -> VersionKey:
+    """
+    Split a version name into its numbers and words so versions can be compared. Numbers sort
+    before words in the same position. Version names rarely change, so they're parsed once.
+
+    >>> parse_version('Katello 4.10.0')
+    ((1, 'Katello'), (0, 4), (0, 10), (0, 0))
+    >>> parse_version('3.9.0') < parse_version('3.10.0') < parse_version('3.10.0.1')
+    True
+    >>> parse_version('3.10.0') < parse_version('3.10.rc1')
+    True
+    """
+    return tuple((0, int(part)) if part.isdigit() else (1, part)
+                 for part in VERSION_COMPONENT_REGEX.findall(name))
+
+
+class VersionIndex:
+    """
+    The open versions of a project. The latest version for a prefix is looked up once and then
+    remembered until a version it could be is added, changed or closed.
+
+    >>> from types import SimpleNamespace
+    >>> index = VersionIndex([SimpleNamespace(id=i, name=name, updated_on=1) for i, name in
+    ...                       enumerate(('3.9.0', '3.10.0', '3.10.1', 'Katello 4.10.0', '3.9-rc'))])
+    >>> index.latest('').name
+    '3.10.1'
+    >>> index.latest('3.9.').name
+    '3.9.0'
+    >>> index.latest('Katello 4.10.').name
+    'Katello 4.10.0'
+    >>> index.latest('4.0.') is None
+    True
+
+    When the versions are fetched again, only the ones that changed are looked at.
+
+    >>> versions = [SimpleNamespace(id=0, name='3.9.0', updated_on=1),
+    ...             SimpleNamespace(id=1, name='3.10.0', updated_on=1),
+    ...             SimpleNamespace(id=3, name='Katello 4.10.0', updated_on=1),
+    ...             SimpleNamespace(id=5, name='3.9.1', updated_on=2)]
+    >>> index.refresh(versions)
+    3
+    >>> index.latest('').name, index.latest('3.9.').name, index.latest('Katello 4.10.').name
+    ('3.10.0', '3.9.1', 'Katello 4.10.0')
+    >>> index.refresh(versions)
+    0
+    """
+
+    def __init__(self, versions: Iterable[CustomField]):
+        self.versions: dict[int, tuple[VersionKey, CustomField]] = {
+            version.id: (parse_version(version.name), version) for version in versions}
+        self._latest: dict[str, Optional[CustomField]] = {}
+
+    def __len__(self) -> int:
+        return len(self.versions)
+
+    def refresh(self, versions: Iterable[CustomField]) -> int:
+        """
+        Replace the versions with ones that were fetched again and return how many of them were
+        added, changed or closed since
+        """
+        fetched = {version.id: version for version in versions}
+        changed = [version for version_id, version in fetched.items()
+                   if version_id not in self.versions
+                   or _get_updated_on(self.versions[version_id][1]) is None
+                   or _get_updated_on(self.versions[version_id][1]) != _get_updated_on(version)]
+        closed = [self.versions.pop(version_id)[1] for version_id in list(self.versions)
+                  if version_id not in fetched]
+        names = [version.name for version in changed + closed]
+        for version in changed:
+            if version.id in self.versions:
+                # It may have been renamed
+                names.append(self.versions[version.id][1].name)
+            self.versions[version.id] = (parse_version(version.name), version)
+
+        for version_prefix in list(self._latest):
+            if any(_matches_prefix(name, version_prefix) for name in names):
+                del self._latest[version_prefix]
+        return len(changed) + len(closed)
+
+    def latest(self, version_prefix: str) -> Optional[CustomField]:
+        try:
+            return self._latest[version_prefix]
+        except KeyError:
+            pass
+
+        candidates = [(key, version) for key, version in self.versions.values()
+                      if _matches_prefix(version.name, version_prefix)]
+        latest = max(candidates, key=lambda candidate: candidate[0])[1] if candidates else None
+        self._latest[version_prefix] = latest
+        return latest
+
+
+def _get_updated_on(version: CustomField) -> Any:
+    # Versions of older Redmine releases have no updated_on, so they're always considered changed
+    return getattr(version, 'updated_on', None)
+
+
+async def get_latest_open_version(project: Project, version_prefix: str) \
+        -> Optional[CustomField]:
+    version = (await get_open_versions(project)).latest(version_prefix)
+    if version is None:
+        logger.warning('No versions found for %s with prefix %r', project.name, version_prefix)
+    return version
+
+
+def _matches_prefix(name: str, version_prefix: str) -> bool:
+    """
+    >>> _matches_prefix('3.9.1', '3.9.'), _matches_prefix('3.9.1', ''), _matches_prefix('3.9', '3')
+    (True, True, False)
+    """
+    if not name.startswith(version_prefix):
+        return False
+    name = name.removeprefix(version_prefix)
+    return bool(name) and name[0].isdigit()
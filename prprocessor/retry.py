@@ -0,0 +1,230 @@
+import asyncio
+import dataclasses
+import logging
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from prprocessor.ratelimit import backoff
+
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How a single call is retried. Only errors of the given classes are retried, anything else
+    is assumed to fail again. The deadline limits the total time spent on all attempts.
+    """
+    retry_on: tuple[type[Exception], ...]
+    attempts: int = 3
+    base: float = 0.5
+    cap: float = 10
+    deadline: Optional[float] = None
+
+    def is_retryable(self, exc: Exception) -> bool:
+        return isinstance(exc, self.retry_on)
+
+    def replace(self, **changes) -> 'RetryPolicy':
+        return dataclasses.replace(self, **changes)
+
+
+NO_RETRY = RetryPolicy(retry_on=(), attempts=1)
+
+
+class RetryBudget:
+    """
+    Limit retries to a fraction of all calls to a service, so a service that's failing isn't
+    hit with a multiple of the normal load. The minimum allows some retries when it's quiet.
+
+    >>> budget = RetryBudget('example', ratio=0.5, minimum=1)
+    >>> budget.spend(), budget.spend()
+    (True, False)
+    >>> budget.deposit(); budget.deposit()
+    >>> budget.spend()
+    True
+    """
+
+    def __init__(self, name: str, ratio: float = 0.2, minimum: int = 10):
+        self.name = name
+        self.ratio = ratio
+        self.minimum = minimum
+        self.retries = 0
+        self.exhausted = 0
+        self._tokens = float(minimum)
+
+    def deposit(self) -> None:
+        self._tokens = min(self._tokens + self.ratio, max(self.minimum, 100 * self.ratio))
+
+    def spend(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f'{name} is unavailable, retrying in {retry_in:.0f} seconds')
+        self.name = name
+        self.retry_in = retry_in
+
+
+class State(Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """
+    Stop calling a service after a number of consecutive failures. After the reset timeout a
+    single trial call is let through; if it succeeds the circuit closes again.
+
+    >>> now = 0
+    >>> breaker = CircuitBreaker('example', threshold=2, reset_timeout=10, clock=lambda: now)
+    >>> breaker.failure(); breaker.failure()
+    >>> breaker.state
+    <State.OPEN: 'open'>
+    >>> try:
+    ...     breaker.check()
+    ... except CircuitOpenError as exc:
+    ...     print(exc)
+    example is unavailable, retrying in 10 seconds
+    >>> now = 10
+    >>> breaker.check()
+    >>> breaker.state
+    <State.HALF_OPEN: 'half-open'>
+    >>> breaker.success()
+    >>> breaker.state
+    <State.CLOSED: 'closed'>
+    """
+
+    def __init__(self, name: str, threshold: int = 5, reset_timeout: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = State.CLOSED
+        self.failures = 0
+        self._clock = clock
+        self._opened_at = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.state == State.CLOSED
+
+    @property
+    def retry_in(self) -> float:
+        """
+        Seconds until a trial call may be made
+        """
+        if self.state == State.CLOSED:
+            return 0
+        return max(self._opened_at + self.reset_timeout - self._clock(), 0)
+
+    def check(self) -> None:
+        """
+        Raise CircuitOpenError unless a call may be made
+        """
+        if self.state == State.CLOSED:
+            return
+
+        retry_in = self.retry_in
+        if self.state == State.OPEN and retry_in <= 0:
+            logger.info('Trying %s again', self.name)
+            self.state = State.HALF_OPEN
+            return
+
+        # While half open only the trial call is made
+        raise CircuitOpenError(self.name, retry_in)
+
+    def success(self) -> None:
+        if self.state != State.CLOSED:
+            logger.info('%s is available again', self.name)
+        self.state = State.CLOSED
+        self.failures = 0
+
+    def abort(self) -> None:
+        """
+        The trial call ended without an answer, for example because it was cancelled, so another
+        one may be made right away
+        """
+        if self.state == State.HALF_OPEN:
+            self.state = State.OPEN
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == State.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != State.OPEN:
+                logger.warning('%s failed %s times, not calling it for %s seconds', self.name,
+                               self.failures, self.reset_timeout)
+            self.state = State.OPEN
+            self._opened_at = self._clock()
+
+
+async def call_with_retry(factory: Callable[[], Awaitable[T]], policy: RetryPolicy,
+                          budget: Optional[RetryBudget] = None,
+                          breaker: Optional[CircuitBreaker] = None,
+                          clock: Callable[[], float] = time.monotonic) -> T:
+    """
+    Make a call and retry it according to the policy. Retries are taken from the budget and
+    only retryable errors count as failures for the breaker.
+
+    >>> calls = []
+    >>> async def flaky():
+    ...     calls.append(len(calls))
+    ...     if len(calls) < 3:
+    ...         raise ConnectionError()
+    ...     return 'ok'
+    >>> policy = RetryPolicy(retry_on=(ConnectionError,), base=0.001)
+    >>> asyncio.run(call_with_retry(flaky, policy)), len(calls)
+    ('ok', 3)
+    """
+    deadline = None if policy.deadline is None else clock() + policy.deadline
+    attempt = 1
+    while True:
+        if breaker is not None:
+            breaker.check()
+
+        try:
+            result = await factory()
+        except Exception as exc:  # pylint: disable=broad-except
+            retryable = policy.is_retryable(exc)
+            if breaker is not None:
+                # Any other error means the service did respond
+                if retryable:
+                    breaker.failure()
+                else:
+                    breaker.success()
+            if not retryable or attempt >= policy.attempts:
+                raise
+
+            delay = backoff(attempt, base=policy.base, cap=policy.cap)
+            if deadline is not None and clock() + delay > deadline:
+                logger.warning('Not retrying after %r, the deadline would be exceeded', exc)
+                raise
+            if budget is not None and not budget.spend():
+                logger.warning('Not retrying after %r, the %s retry budget is exhausted',
+                               exc, budget.name)
+                raise
+
+            logger.info('Retrying in %.1f seconds after %r (attempt %s)', delay, exc, attempt)
+            await asyncio.sleep(delay)
+            attempt += 1
+        except BaseException:
+            # Cancelled, which says nothing about the service
+            if breaker is not None:
+                breaker.abort()
+            raise
+        else:
+            if breaker is not None:
+                breaker.success()
+            if budget is not None:
+                budget.deposit()
+            return result
@@ -0,0 +1,255 @@
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class _PendingJob(Generic[T]):
+    def __init__(self, factory: Callable[[], Awaitable[T]], version: Any):
+        self.factory = factory
+        self.version = version
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.events = 1
+
+
+class Debouncer(Generic[K, T]):
+    """
+    Collapse bursts of work for the same key into a single job.
+
+    A submitted job only starts after the delay. Anything submitted for the same key before it
+    starts replaces it, so only the latest job runs and all submitters receive its result. Jobs
+    for the same key never run concurrently.
+
+    Submissions can arrive out of order, so a job can be given a version. A job doesn't replace
+    a pending job with a newer version, but its submitter still receives the result.
+
+    >>> async def example():
+    ...     debouncer = Debouncer(delay=0.01)
+    ...     async def job(value):
+    ...         return value
+    ...     results = await asyncio.gather(*(debouncer.submit('pr', lambda i=i: job(i))
+    ...                                      for i in range(3)))
+    ...     return results, debouncer.coalesced
+    >>> asyncio.run(example())
+    ([2, 2, 2], 2)
+    >>> async def out_of_order():
+    ...     debouncer = Debouncer(delay=0.01)
+    ...     async def job(value):
+    ...         return value
+    ...     return await asyncio.gather(*(debouncer.submit('pr', lambda i=i: job(i), version=i)
+    ...                                   for i in (1, 3, 2)))
+    >>> asyncio.run(out_of_order())
+    [3, 3, 3]
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.coalesced = 0
+        self._pending: dict[K, _PendingJob[T]] = {}
+        self._running: dict[K, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, key: K, factory: Callable[[], Awaitable[T]],
+                     version: Any = None) -> T:
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _PendingJob(factory, version)
+            task = asyncio.create_task(self._run(key, pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            if version is None or pending.version is None or not version < pending.version:
+                pending.factory = factory
+                pending.version = version
+            else:
+                logger.debug('Not replacing the job for %s with an older version', key)
+            pending.events += 1
+            self.coalesced += 1
+
+        # Shielded so one submitter being cancelled doesn't cancel the job for everyone
+        return await asyncio.shield(pending.future)
+
+    async def _run(self, key: K, pending: _PendingJob[T]) -> None:
+        current = asyncio.current_task()
+        try:
+            await asyncio.sleep(self.delay)
+
+            previous: Optional[asyncio.Task] = self._running.get(key)
+            self._running[key] = current  # type: ignore[assignment]
+            if previous is not None:
+                await asyncio.wait([previous])
+
+            # From here on new submissions start a new job
+            del self._pending[key]
+            if pending.events > 1:
+                logger.info('Coalesced %s events for %s', pending.events, key)
+
+            try:
+                result = await pending.factory()
+            except Exception as exc:  # pylint: disable=broad-except
+                pending.future.set_exception(exc)
+                # Retrieve it so asyncio doesn't complain when nobody else was waiting
+                pending.future.exception()
+            else:
+                pending.future.set_result(result)
+        finally:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+            if not pending.future.done():
+                pending.future.cancel()
+            if self._running.get(key) is current:
+                del self._running[key]
+
+
+class JobScheduler:
+    """
+    Run jobs on a fixed number of workers.
+
+    Jobs are queued per group and the groups are served round robin, so a burst of jobs in one
+    group doesn't delay the others. When too many jobs are queued, submitting waits for space.
+    Jobs run in the context they were submitted from.
+
+    Until the scheduler is started, jobs run directly when they're submitted.
+
+    >>> async def example():
+    ...     scheduler = JobScheduler(concurrency=1, max_queued=10)
+    ...     scheduler.start()
+    ...     order = []
+    ...     async def job(name):
+    ...         order.append(name)
+    ...     for name in ('a1', 'a2', 'a3', 'b1'):
+    ...         await scheduler.submit(name[0], lambda name=name: job(name))
+    ...     await scheduler.drain(timeout=1)
+    ...     return order
+    >>> asyncio.run(example())
+    ['a1', 'b1', 'a2', 'a3']
+    """
+
+    def __init__(self, concurrency: int, max_queued: int):
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self._queues: dict[Hashable, deque[tuple[contextvars.Context, Callable]]] = {}
+        self._groups: deque[Hashable] = deque()
+        self._queued = 0
+        # Submitters waiting for space in the queue
+        self._waiting = 0
+        self._accepting = False
+        self._stopped = False
+        self._condition: Optional[asyncio.Condition] = None
+        self._workers: list[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return self._queued
+
+    @property
+    def started(self) -> bool:
+        return self._accepting
+
+    @property
+    def full(self) -> bool:
+        """
+        Whether a new job would have to wait for space in the queue
+        """
+        return self._queued + self._waiting >= self.max_queued
+
+    def start(self) -> None:
+        # Created here so it's bound to the running loop
+        self._condition = asyncio.Condition()
+        self._accepting = True
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def submit(self, group: Hashable, factory: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Queue a job, waiting for space if the queue is full. Jobs submitted after draining
+        started are dropped since nothing would run them.
+        """
+        if self._stopped:
+            logger.warning('Dropping a job for %s, the scheduler is stopping', group)
+            return
+        if not self._accepting or self._condition is None:
+            await factory()
+            return
+
+        async with self._condition:
+            if self._queued >= self.max_queued:
+                logger.warning('Job queue is full (%s), waiting for space', self._queued)
+                self._waiting += 1
+                try:
+                    await self._condition.wait_for(
+                        lambda: self._queued < self.max_queued or not self._accepting)
+                finally:
+                    self._waiting -= 1
+                if not self._accepting:
+                    logger.warning('Dropping a job for %s, the scheduler is stopping', group)
+                    return
+
+            if group not in self._queues:
+                self._queues[group] = deque()
+                self._groups.append(group)
+            self._queues[group].append((contextvars.copy_context(), factory))
+            self._queued += 1
+            self._condition.notify_all()
+
+    async def _next(self) -> Optional[tuple[contextvars.Context, Callable]]:
+        assert self._condition is not None
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._queued or not self._accepting)
+            if not self._queued:
+                return None
+
+            group = self._groups.popleft()
+            queue = self._queues[group]
+            job = queue.popleft()
+            if queue:
+                self._groups.append(group)
+            else:
+                del self._queues[group]
+
+            self._queued -= 1
+            self.running += 1
+            self._condition.notify_all()
+            return job
+
+    async def _work(self) -> None:
+        while (job := await self._next()) is not None:
+            context, factory = job
+            try:
+                await context.run(asyncio.create_task, factory())
+            except Exception:  # pylint: disable=broad-except
+                self.failed += 1
+                logger.exception('Background job failed')
+            finally:
+                self.running -= 1
+                self.completed += 1
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Stop accepting new jobs and wait for the queued ones to finish
+        """
+        if not self._accepting or self._condition is None:
+            return
+
+        async with self._condition:
+            self._accepting = False
+            self._stopped = True
+            self._condition.notify_all()
+
+        logger.info('Waiting for %s queued and %s running jobs', self._queued, self.running)
+        _, pending = await asyncio.wait(self._workers, timeout=timeout)
+        if pending:
+            logger.warning('Cancelling %s workers with %s jobs left', len(pending), self._queued)
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
@@ -0,0 +1,261 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Generator, Iterable, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+# Spans are appended to this file as JSON lines
+TRACE_FILE = os.environ.get('TRACE_FILE')
+# An OTLP/HTTP traces endpoint like http://localhost:4318/v1/traces
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT')
+
+SERVICE_NAME = 'prprocessor'
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def new_id(bits: int = 64) -> str:
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+class Trace:
+    """
+    Collects the finished spans of a single event until its root span ends
+    """
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: list['Span'] = []
+        self.finished = False
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'attributes', 'start', 'end', 'error')
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str] = None,
+                 attributes: Optional[dict[str, Any]] = None):
+        self.trace = trace
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time_ns()
+        self.end: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        The span as written to the JSON lines file
+        """
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start / 1e9,
+            'duration': self.duration,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+    def to_otlp(self) -> dict[str, Any]:
+        """
+        The span in the OTLP JSON encoding
+        """
+        span: dict[str, Any] = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,  # internal
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end or time.time_ns()),
+            'attributes': [{'key': key, 'value': otlp_value(value)}
+                           for key, value in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def otlp_value(value: Any) -> dict[str, Any]:
+    """
+    >>> otlp_value(True), otlp_value(3), otlp_value(0.5), otlp_value('PR')
+    ({'boolValue': True}, {'intValue': '3'}, {'doubleValue': 0.5}, {'stringValue': 'PR'})
+    """
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class JsonLinesExporter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: Iterable[Span]) -> None:
+        lines = ''.join(json.dumps(span.to_dict(), default=str) + '\n' for span in spans)
+        try:
+            with open(self.path, 'a') as trace_fp:
+                trace_fp.write(lines)
+        except OSError:
+            logger.exception('Failed to write spans to %s', self.path)
+
+    async def close(self) -> None:
+        pass
+
+
+class OtlpExporter:
+    """
+    Sends every finished trace to an OTLP/HTTP endpoint in the background
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 10):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._session: Optional[ClientSession] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def export(self, spans: Iterable[Span]) -> None:
+        data = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name',
+                                         'value': otlp_value(SERVICE_NAME)}]},
+            'scopeSpans': [{'scope': {'name': __name__},
+                            'spans': [span.to_otlp() for span in spans]}],
+        }]}
+        task = asyncio.get_running_loop().create_task(self._send(data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, data: dict[str, Any]) -> None:
+        if self._session is None:
+            self._session = ClientSession(timeout=ClientTimeout(total=self.timeout))
+        try:
+            async with self._session.post(self.endpoint, json=data) as response:
+                response.raise_for_status()
+        except (ClientError, asyncio.TimeoutError) as exc:
+            logger.warning('Failed to send spans to %s: %s', self.endpoint, exc)
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=self.timeout)
+        if self._session is not None:
+            await self._session.close()
+
+
+def get_exporters() -> list:
+    exporters: list = []
+    if TRACE_FILE:
+        exporters.append(JsonLinesExporter(TRACE_FILE))
+    if TRACE_OTLP_ENDPOINT:
+        exporters.append(OtlpExporter(TRACE_OTLP_ENDPOINT))
+    return exporters
+
+
+EXPORTERS = get_exporters()
+
+_current_span: contextvars.ContextVar[Optional[Span]] = \
+    contextvars.ContextVar('current_span', default=None)
+
+
+def _export(spans: list[Span]) -> None:
+    for exporter in EXPORTERS:
+        exporter.export(spans)
+
+
+def _finish(span: Span) -> None:
+    span.end = time.time_ns()
+    trace = span.trace
+    if trace.finished:
+        # Work the event started in the background outlived it
+        _export([span])
+    elif span.parent_id is None:
+        trace.spans.append(span)
+        trace.finished = True
+        _export(trace.spans)
+    else:
+        trace.spans.append(span)
+
+
+@contextmanager
+def _run(span: Span) -> Generator[Span, None, None]:
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.error = f'{type(exc).__name__}: {exc}'
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(span)
+
+
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None,
+                **attributes: Any) -> Generator[Optional[Span], None, None]:
+    """
+    Trace everything that happens within, typically a single event. Nothing is recorded unless
+    an exporter is configured.
+
+    >>> class PrintExporter:
+    ...     def export(self, spans):
+    ...         print([(span.name, span.parent_id is None, span.error) for span in spans])
+    >>> EXPORTERS.append(PrintExporter())
+    >>> with start_trace('event'):
+    ...     with span('stage'):
+    ...         pass
+    ...     try:
+    ...         with span('request'):
+    ...             raise ValueError('failed')
+    ...     except ValueError:
+    ...         pass
+    [('stage', False, None), ('request', False, 'ValueError: failed'), ('event', True, None)]
+    >>> _ = EXPORTERS.pop()
+    """
+    if not EXPORTERS:
+        yield None
+        return
+
+    with _run(Span(Trace(trace_id or new_id(128)), name, attributes=attributes)) as root:
+        yield root
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Generator[Optional[Span], None, None]:
+    """
+    Time a part of the current trace. Outside of a trace this does nothing.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    with _run(Span(parent.trace, name, parent.span_id, attributes)) as child:
+        yield child
+
+
+def set_attributes(**attributes: Any) -> None:
+    """
+    Add attributes to the current span, if any
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+async def close_exporters() -> None:
+    for exporter in EXPORTERS:
+        await exporter.close()
@@ -0,0 +1,54 @@
+"""
+Runs the GitHub and Redmine stand-ins of the benchmarks, with the app's clients pointed at them
+"""
+import unittest
+from unittest import mock
+
+from aiohttp import ClientSession
+from octomachinery.app.runtime.context import RUNTIME_CONTEXT
+from octomachinery.github.api.raw_client import RawGitHubAPI
+from octomachinery.github.api.tokens import GitHubOAuthToken
+from redminelib import Redmine
+
+from benchmarks.__main__ import Scenario, make_commits, reset_caches
+from benchmarks.stubs import GitHubStub, RedmineStub
+from prprocessor import __main__ as app, redmine
+
+
+class StubbedServicesTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.github = GitHubStub(latency=0)
+        self.redmine = RedmineStub(latency=0, projects=['foreman'])
+        await self.github.start()
+        self.addAsyncCleanup(self.github.stop)
+        await self.redmine.start()
+        self.addAsyncCleanup(self.redmine.stop)
+
+        session = ClientSession()
+        self.addAsyncCleanup(session.close)
+        self.client = RawGitHubAPI(GitHubOAuthToken('test'), session=session,
+                                   user_agent='prprocessor-test', base_url=self.github.url)
+        RUNTIME_CONTEXT.app_installation_client = self.client
+
+        async def get_installation_clients(github_app, repositories):
+            return {repository: self.client for repository in repositories}
+
+        for patcher in (
+                mock.patch.object(app, 'get_installation_clients', get_installation_clients),
+                mock.patch.object(redmine, '_redmine', Redmine(self.redmine.url)),
+                mock.patch.object(redmine, 'REDMINE_JOURNAL', '')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        reset_caches()
+        self.scenario = Scenario('test', '', self.github.url)
+
+    def add_pull_request(self, number, issue_ids, state='open', merged=False):
+        commits = make_commits(1, issue_ids)
+        pull_request = self.scenario.add_pull_request(number, commits)
+        pull_request.update(state=state, merged=merged,
+                            html_url=f'https://github.com/theforeman/foreman/pull/{number}')
+        self.github.add_pull_request(pull_request, commits)
+        return pull_request
+
+    def get_links(self, issue_id):
+        return self.redmine.issues[issue_id]['custom_fields'][0]['value']
@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+from prprocessor import __main__ as app
+
+
+def make_pull_request(sha, state='open'):
+    return {
+        'number': 1,
+        'state': state,
+        'head': {'sha': sha},
+        'base': {'repo': {'full_name': 'theforeman/foreman',
+                          'url': 'https://api.github.com/repos/theforeman/foreman'}},
+    }
+
+
+class TestRecheckPullRequest(unittest.IsolatedAsyncioTestCase):
+    async def recheck(self, pull_request, check_runs):
+        async def github_call(method, url, **kwargs):
+            if url.endswith('/pulls/1'):
+                return pull_request
+            self.assertEqual(kwargs['url_vars']['sha'], pull_request['head']['sha'])
+            return {'check_runs': check_runs}
+
+        with mock.patch.object(app, 'github_call', github_call), \
+                mock.patch.object(app, 'schedule_pull_request_check') as schedule:
+            await app.recheck_pull_request('theforeman/foreman', 1)
+        return schedule
+
+    async def test_pushed_during_outage(self):
+        pull_request = make_pull_request('new')
+        check_run = {'id': 2, 'head_sha': 'new', 'status': 'queued'}
+        schedule = await self.recheck(pull_request, [check_run])
+        schedule.assert_awaited_once_with(pull_request, check_run, use_cache=False)
+
+    async def test_checked_since(self):
+        schedule = await self.recheck(make_pull_request('new'),
+                                      [{'id': 2, 'head_sha': 'new', 'status': 'completed'}])
+        schedule.assert_not_awaited()
+
+    async def test_closed(self):
+        schedule = await self.recheck(make_pull_request('new', state='closed'), [])
+        schedule.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
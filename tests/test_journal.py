@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from redminelib import Redmine
+from redminelib.engines.base import BaseEngine
+from redminelib.exceptions import ValidationError
+
+from prprocessor import redmine
+from prprocessor.journal import Journal
+
+
+class FakeEngine(BaseEngine):
+    """
+    Answers like Redmine with a single issue, which can be made to refuse updates
+    """
+    fail_updates = False
+    updates: list = []
+
+    @staticmethod
+    def create_session(**params):
+        return None
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        if method == 'get':
+            issue = {'id': 1, 'status': {'id': 1, 'name': 'New'},
+                     'custom_fields': [{'id': redmine.Field.PULL_REQUEST, 'name': 'Pull request',
+                                        'multiple': True, 'value': []}]}
+            return {'issues': [issue], 'total_count': 1, 'offset': 0, 'limit': 100}
+        if self.fail_updates:
+            raise ValidationError('Pull request is invalid')
+        self.updates.append(data)
+        return True
+
+
+class TestReplayJournal(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'journal.sqlite')
+        self.redmine = Redmine('https://redmine.example.com', engine=FakeEngine)
+        FakeEngine.fail_updates = False
+        FakeEngine.updates = []
+        self.restart()
+
+    def restart(self):
+        if redmine._journal is not None:  # pylint: disable=protected-access
+            redmine._journal.close()  # pylint: disable=protected-access
+        journal = Journal(self.path)
+        self.addCleanup(journal.close)
+        patcher = mock.patch.object(redmine, '_journal', journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        redmine.ISSUE_CACHE.clear()
+        return journal
+
+    async def link(self):
+        issues = await redmine.get_issues(self.redmine, {1})
+        mutation = redmine.Mutation(1, redmine.Action.LINK_PULL_REQUEST,
+                                    pull_request='https://github.com/theforeman/foreman/pull/1')
+        await redmine.update_issues(issues, [mutation])
+        await redmine.flush_updates()
+
+    async def test_replay_after_failure(self):
+        FakeEngine.fail_updates = True
+        with self.assertLogs(redmine.logger, 'ERROR'):
+            await self.link()
+        self.assertEqual([entry.attempts for entry in redmine.get_journal().pending()], [1])
+
+        FakeEngine.fail_updates = False
+        journal = self.restart()
+        await redmine.replay_journal(self.redmine)
+
+        self.assertEqual(len(FakeEngine.updates), 1)
+        self.assertEqual(journal.pending(), [])
+
+    async def test_drop_after_max_attempts(self):
+        FakeEngine.fail_updates = True
+        with self.assertLogs(redmine.logger, 'ERROR'):
+            await self.link()
+
+        for attempts in range(2, redmine.REDMINE_JOURNAL_MAX_ATTEMPTS + 1):
+            journal = self.restart()
+            with self.assertLogs(redmine.logger, 'ERROR'):
+                await redmine.replay_journal(self.redmine)
+            self.assertEqual([entry.attempts for entry in journal.pending()], [attempts])
+
+        journal = self.restart()
+        with self.assertLogs(redmine.logger, 'ERROR'):
+            await redmine.replay_journal(self.redmine)
+        self.assertEqual(journal.pending(), [])
+        self.assertEqual(FakeEngine.updates, [])
+
+    async def test_unusable_journal(self):
+        # The directory of the journal can't be created inside a file
+        with mock.patch.object(redmine, '_journal', Journal(os.path.join(self.path, 'journal'))):
+            open(self.path, 'w').close()
+            with self.assertLogs(redmine.logger, 'ERROR'):
+                await self.link()
+
+        self.assertEqual(len(FakeEngine.updates), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
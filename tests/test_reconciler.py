@@ -0,0 +1,34 @@
+import unittest
+
+from services import StubbedServicesTestCase
+
+from prprocessor import __main__ as app
+
+
+class TestLinkReconciler(StubbedServicesTestCase):
+    async def reconcile(self):
+        reconciler = app.LinkReconciler(None, batch_size=10)
+        await reconciler.run()
+        await app.flush_updates()
+
+    async def test_removes_stale_link(self):
+        closed = self.add_pull_request(1, [30001], state='closed')
+        merged = self.add_pull_request(2, [30001], state='closed', merged=True)
+        self.redmine.get_or_create_issue(30001)['custom_fields'][0]['value'].extend(
+            [closed['html_url'], merged['html_url']])
+
+        await self.reconcile()
+
+        self.assertEqual(self.get_links(30001), [merged['html_url']])
+
+    async def test_adds_missing_link(self):
+        pull_request = self.add_pull_request(1, [30002])
+        self.redmine.get_or_create_issue(30002)
+
+        await self.reconcile()
+
+        self.assertEqual(self.get_links(30002), [pull_request['html_url']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+
+from prprocessor.retry import (CircuitBreaker, CircuitOpenError, NO_RETRY, State,
+                               call_with_retry)
+
+
+class TestCircuitBreaker(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker('example', threshold=1, reset_timeout=10,
+                                      clock=lambda: self.now)
+        self.breaker.failure()
+        self.now = 10
+
+    async def test_cancelled_trial_allows_another(self):
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(60)
+
+        task = asyncio.create_task(call_with_retry(hang, NO_RETRY, breaker=self.breaker))
+        await started.wait()
+        self.assertEqual(self.breaker.state, State.HALF_OPEN)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertEqual(self.breaker.state, State.OPEN)
+        self.assertEqual(self.breaker.retry_in, 0)
+
+        async def answer():
+            return 'ok'
+
+        self.assertEqual(await call_with_retry(answer, NO_RETRY, breaker=self.breaker), 'ok')
+        self.assertEqual(self.breaker.state, State.CLOSED)
+
+    async def test_only_one_trial(self):
+        self.breaker.check()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()
+
+
+if __name__ == '__main__':
+    unittest.main()
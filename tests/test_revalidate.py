@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from services import StubbedServicesTestCase
+
+from prprocessor import __main__ as app
+
+
+class TestRevalidate(StubbedServicesTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        patcher = mock.patch.object(app, 'GitHubApp')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pull_request = self.add_pull_request(1, [30001])
+        self.redmine.get_or_create_issue(30001)
+
+    async def revalidate(self, progress_path=None, dry_run=False):
+        self.github.calls.clear()
+        self.redmine.calls.clear()
+        return await app.revalidate(SimpleNamespace(github=None), ['theforeman/foreman'], 4,
+                                    progress_path, dry_run)
+
+    def writes(self, stub):
+        return sorted(call for call in stub.calls if not call.startswith('GET '))
+
+    async def test_dry_run(self):
+        with self.assertLogs('prprocessor', 'INFO') as logs:
+            self.assertTrue(await self.revalidate(dry_run=True))
+
+        self.assertIn("'changed': 1", logs.output[-1])
+        self.assertEqual(self.writes(self.github), [])
+        self.assertEqual(self.writes(self.redmine), [])
+        self.assertEqual(self.get_links(30001), [])
+
+    async def test_progress(self):
+        with tempfile.TemporaryDirectory() as path:
+            progress_path = os.path.join(path, 'progress.jsonl')
+            self.assertTrue(await self.revalidate(progress_path))
+            with open(progress_path) as progress_fp:
+                entries = [json.loads(line) for line in progress_fp]
+            self.assertEqual(entries, [{'pull_request': 'theforeman/foreman#1',
+                                        'sha': self.pull_request['head']['sha'],
+                                        'outcome': 'updated'}])
+            self.assertEqual(self.get_links(30001), [self.pull_request['html_url']])
+
+            # The PR wasn't pushed to, so it's skipped
+            with self.assertLogs('prprocessor', 'INFO') as logs:
+                self.assertTrue(await self.revalidate(progress_path))
+            self.assertIn("'skipped': 1", logs.output[-1])
+            self.assertNotIn('GET /repos/{owner}/{repo}/pulls/{number}', self.github.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
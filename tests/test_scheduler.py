@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+
+from prprocessor.scheduler import JobScheduler
+
+
+class TestJobScheduler(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.scheduler = JobScheduler(concurrency=1, max_queued=1)
+        self.scheduler.start()
+        self.release = asyncio.Event()
+        self.done = []
+
+    async def job(self, name):
+        await self.release.wait()
+        self.done.append(name)
+
+    async def test_full(self):
+        await self.scheduler.submit('a', lambda: self.job('running'))
+        # Let the worker pick up the first job
+        await asyncio.sleep(0)
+        self.assertFalse(self.scheduler.full)
+
+        await self.scheduler.submit('a', lambda: self.job('queued'))
+        self.assertTrue(self.scheduler.full)
+
+        self.release.set()
+        await self.scheduler.drain(timeout=1)
+        self.assertEqual(self.done, ['running', 'queued'])
+
+    async def test_submit_after_drain(self):
+        await self.scheduler.drain(timeout=1)
+        with self.assertLogs('prprocessor.scheduler', 'WARNING'):
+            await self.scheduler.submit('a', lambda: self.job('late'))
+        self.release.set()
+        await asyncio.sleep(0)
+        self.assertEqual(self.done, [])
+
+    async def test_waiting_submit_during_drain(self):
+        await self.scheduler.submit('a', lambda: self.job('running'))
+        await asyncio.sleep(0)
+        await self.scheduler.submit('a', lambda: self.job('queued'))
+        waiting = asyncio.create_task(self.scheduler.submit('a', lambda: self.job('waiting')))
+        await asyncio.sleep(0)
+
+        with self.assertLogs('prprocessor.scheduler', 'WARNING'):
+            drain = asyncio.create_task(self.scheduler.drain(timeout=1))
+            await waiting
+        self.release.set()
+        await drain
+        self.assertEqual(self.done, ['running', 'queued'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from unittest import mock
+
+from redminelib import Redmine
+from redminelib.engines.base import BaseEngine
+
+from prprocessor import redmine
+from prprocessor.redmine import Action, Field, Mutation, Status, WriteBuffer
+
+PR_1 = 'https://github.com/theforeman/foreman/pull/1'
+PR_2 = 'https://github.com/theforeman/foreman/pull/2'
+
+
+class RecordingEngine(BaseEngine):
+    sent: list = []
+
+    @staticmethod
+    def create_session(**params):
+        return None
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        self.sent.append((method, url, data))
+        return True
+
+
+class TestWriteBuffer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(redmine, 'REDMINE_JOURNAL', '')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        RecordingEngine.sent = []
+        self.redmine = Redmine('https://redmine.example.com', engine=RecordingEngine)
+        self.buffer = WriteBuffer(delay=60)
+
+    def make_issue(self, issue_id, status=Status.NEW, pull_requests=()):
+        return self.redmine.issue.to_resource({
+            'id': issue_id,
+            'status': {'id': status.value, 'name': status.name},
+            'custom_fields': [
+                {'id': Field.PULL_REQUEST.value, 'name': 'Pull request', 'multiple': True,
+                 'value': list(pull_requests)},
+                {'id': Field.FIXED_IN_VERSIONS.value, 'name': 'Fixed in Releases',
+                 'multiple': True, 'value': []},
+            ],
+        })
+
+    def saved(self):
+        return {url: data['issue'] for method, url, data in RecordingEngine.sent
+                if method == 'put'}
+
+    async def test_merged_into_single_save(self):
+        issue = self.make_issue(1)
+        self.buffer.add(issue, [Mutation(1, Action.LINK_PULL_REQUEST, pull_request=PR_1)], [])
+        self.buffer.add(issue, [Mutation(1, Action.LINK_PULL_REQUEST, pull_request=PR_2)], [])
+        self.buffer.add(issue, [Mutation(1, Action.SET_FIXED_IN_VERSION, version_id=5)], [])
+        await self.buffer.flush()
+
+        self.assertEqual(len(RecordingEngine.sent), 1)
+        self.assertEqual((self.buffer.writes, self.buffer.saved_writes), (1, 2))
+        update = self.saved()['https://redmine.example.com/issues/1.json']
+        self.assertEqual(update['status_id'], Status.READY_FOR_TESTING.value)
+        fields = {field['id']: field['value'] for field in update['custom_fields']}
+        self.assertEqual(fields, {Field.PULL_REQUEST.value: [PR_1, PR_2],
+                                  Field.FIXED_IN_VERSIONS.value: ['5']})
+        self.assertEqual(issue.custom_fields.get(Field.PULL_REQUEST).value, [PR_1, PR_2])
+
+    async def test_link_then_unlink(self):
+        issue = self.make_issue(1, status=Status.READY_FOR_TESTING)
+        self.buffer.add(issue, [Mutation(1, Action.LINK_PULL_REQUEST, pull_request=PR_1)], [])
+        self.buffer.add(issue, [Mutation(1, Action.UNLINK_PULL_REQUEST, pull_request=PR_1)], [])
+        await self.buffer.flush()
+
+        # The net result is what the issue already looked like
+        self.assertEqual(RecordingEngine.sent, [])
+        self.assertEqual((self.buffer.writes, self.buffer.saved_writes), (0, 2))
+
+    async def test_unlink_then_link(self):
+        issue = self.make_issue(1, status=Status.READY_FOR_TESTING, pull_requests=[PR_1])
+        self.buffer.add(issue, [Mutation(1, Action.UNLINK_PULL_REQUEST, pull_request=PR_1)], [])
+        self.buffer.add(issue, [Mutation(1, Action.LINK_PULL_REQUEST, pull_request=PR_2)], [])
+        await self.buffer.flush()
+
+        update = self.saved()['https://redmine.example.com/issues/1.json']
+        self.assertNotIn('status_id', update)
+        # python-redmine sends the other custom fields along as they were
+        fields = {field['id']: field['value'] for field in update['custom_fields']}
+        self.assertEqual(fields, {Field.PULL_REQUEST.value: [PR_2],
+                                  Field.FIXED_IN_VERSIONS.value: []})
+
+    async def test_separate_issues(self):
+        for issue_id in (1, 2):
+            issue = self.make_issue(issue_id)
+            self.buffer.add(issue, [Mutation(issue_id, Action.LINK_PULL_REQUEST,
+                                             pull_request=PR_1)], [])
+        await self.buffer.flush()
+
+        self.assertEqual(sorted(self.saved()), ['https://redmine.example.com/issues/1.json',
+                                                'https://redmine.example.com/issues/2.json'])
+        self.assertEqual(self.buffer.writes, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()